@@ -0,0 +1,314 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+
+import server
+import snapshot
+import ranking
+import interest
+import map_transfer
+
+# --- SERVER MICRO-BENCHMARKS ---
+# Times the hot server paths in isolation, with fake sockets and a fixed
+# random seed: broadcast_players, snapshot encode/decode, leaderboard
+# updates and map chunking. Each case reports ops/sec (best of REPEATS)
+# and the peak memory one batch allocates (tracemalloc), and can be
+# compared against a baseline saved earlier on the same machine.
+#
+#   python bench_server.py --save bench_baseline.json
+#   python bench_server.py --compare bench_baseline.json
+
+PLAYER_COUNTS = (1, 8, 32, 128)
+REPEATS = 5
+BATCH_SECONDS = 0.2      # Target duration of one timed batch
+REGRESSION = 0.25        # Slower than baseline by more than this fraction is flagged
+MAP_BYTES = 4 * 1024 * 1024
+SPREAD = 150.0           # Players are placed within +/- this many units
+
+
+class FakeSender:
+    """Stands in for outbound.ThreadedSender: counts bytes instead of writing them."""
+
+    def __init__(self):
+        self.bytes_sent = 0
+        self.frames = 0
+
+    def send(self, data, droppable=False):
+        self.bytes_sent += len(data)
+        self.frames += 1
+
+    def depth(self):
+        return {"messages": 0, "bytes": 0, "dropped": 0}
+
+    def close(self):
+        pass
+
+
+class FakeUdpSocket:
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def sendto(self, data, addr):
+        self.bytes_sent += len(data)
+
+
+class BufferReader:
+    """Serves raw bytes to map_transfer.receive_map like a FrameReader would."""
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def read_raw_into(self, view):
+        n = min(len(view), len(self.data) - self.pos)
+        view[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+def reset_server(n_players, udp_share=0.5):
+    """Fresh server state with `n_players` joined through register_player."""
+    server.clients.clear()
+    server.udp_clients.clear()
+    server.players.clear()
+    server.scores.clear()
+    server.leaderboard = ranking.Ranking()
+    server.leaderboard_sent_version = None
+    server.snapshot_seq = 0
+    server.snapshot_history.clear()
+    server.udp_sock = FakeUdpSocket()
+    for i in range(n_players):
+        pid = str(i)
+        server.register_player(pid, {"name": f"Bench{i}", "color": "red"}, "token",
+                               FakeSender(), ("127.0.0.1", 40000 + i))
+        with server.LOCK:
+            server.apply_position(pid, {"x": random.uniform(-SPREAD, SPREAD), "y": 1.0,
+                                        "z": random.uniform(-SPREAD, SPREAD)})
+            if i < n_players * udp_share:
+                server.clients[pid]["udp_addr"] = ("127.0.0.1", 40000 + i)
+
+
+def random_players(n):
+    return {str(i): {"x": random.uniform(-SPREAD, SPREAD), "y": 1.0,
+                     "z": random.uniform(-SPREAD, SPREAD)} for i in range(n)}
+
+
+def move_players(players, share=0.5):
+    """Copy of `players` with `share` of them moved a step."""
+    moved = dict(players)
+    for pid in random.sample(list(players), max(1, int(len(players) * share))):
+        p = players[pid]
+        moved[pid] = {**p, "x": p["x"] + random.uniform(-0.5, 0.5), "z": p["z"] + random.uniform(-0.5, 0.5)}
+    return moved
+
+
+# --- Cases ---
+# Each case is setup(n) -> op, where op() runs one unit of work.
+
+def case_broadcast(n):
+    reset_server(n)
+    pids = list(server.players)
+
+    def op():
+        with server.LOCK:
+            for pid in pids[: max(1, n // 2)]:
+                p = server.players[pid]
+                server.apply_position(pid, {"x": p["x"] + random.uniform(-0.5, 0.5), "z": p["z"]})
+        server.broadcast_players()
+        # Clients ack what they got, so the next tick sends deltas
+        with server.LOCK:
+            for pid in pids:
+                server.apply_ack(pid, server.snapshot_seq)
+    return op
+
+
+def case_encode_full(n):
+    state = server.build_snapshot_state(random_players(n))
+    now = time.time()
+    # A fresh encoder per op: one client's payload with nothing cached yet
+    return lambda: snapshot.SnapshotEncoder(1, state, {}, now).encode()
+
+
+def case_encode_delta(n):
+    players = random_players(n)
+    history = {1: server.build_snapshot_state(players)}
+    state = server.build_snapshot_state(move_players(players))
+    now = time.time()
+    return lambda: snapshot.SnapshotEncoder(2, state, history, now).encode(1)
+
+
+def case_decode_full(n):
+    state = server.build_snapshot_state(random_players(n))
+    payload = snapshot.SnapshotEncoder(1, state, {}, time.time()).encode()
+    return lambda: snapshot.decode_snapshot(payload)
+
+
+def case_interest(n):
+    players = server.build_snapshot_state(random_players(n))["players"]
+
+    def op():
+        grid = interest.build_grid(players, interest.INTEREST_RADIUS)
+        for pid in players:
+            interest.relevant_players(grid, players, (), pid, None, interest.INTEREST_RADIUS)
+    return op
+
+
+def case_leaderboard(n):
+    board = ranking.Ranking()
+    for i in range(n):
+        board.add(str(i), f"Bench{i}", random.randint(0, 20))
+    pids = [str(i) for i in range(n)]
+
+    def op():
+        pid = random.choice(pids)
+        board.set_score(pid, random.randint(0, 50))
+        board.entries()
+    return op
+
+
+def make_map_file():
+    path = os.path.join(tempfile.gettempdir(), "gtamini_bench_map.bin")
+    if not os.path.exists(path) or os.path.getsize(path) != MAP_BYTES:
+        rng = random.Random(1)
+        # Half random, half repetitive: compresses roughly like a real model file
+        with open(path, 'wb') as f:
+            f.write(bytes(rng.getrandbits(8) for _ in range(MAP_BYTES // 2)))
+            f.write(b"vertex 0.000 1.000 2.000\n" * (MAP_BYTES // 2 // 25))
+            f.write(b"\0" * (MAP_BYTES - f.tell()))
+    return path
+
+
+def case_map_manifest(_):
+    path = make_map_file()
+    return lambda: map_transfer.make_manifest(path)
+
+
+def case_map_receive(_):
+    path = make_map_file()
+    manifest = map_transfer.make_manifest(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    dest = os.path.join(tempfile.gettempdir(), "gtamini_bench_received.bin")
+    return lambda: map_transfer.receive_map(BufferReader(data), manifest, dest)
+
+
+CASES = [
+    ("broadcast", case_broadcast, PLAYER_COUNTS),
+    ("encode_full", case_encode_full, PLAYER_COUNTS),
+    ("encode_delta", case_encode_delta, PLAYER_COUNTS),
+    ("decode_full", case_decode_full, PLAYER_COUNTS),
+    ("interest", case_interest, PLAYER_COUNTS),
+    ("leaderboard", case_leaderboard, PLAYER_COUNTS),
+    ("map_manifest", case_map_manifest, (0,)),
+    ("map_receive", case_map_receive, (0,)),
+]
+
+
+def run_case(setup, n):
+    """Return {"ops_per_sec", "us_per_op", "peak_kib"} for one case."""
+    # The code under test logs with print(); keep that out of the table
+    with contextlib.redirect_stdout(io.StringIO()):
+        return _run_case(setup, n)
+
+
+def _run_case(setup, n):
+    random.seed(1234)
+    op = setup(n)
+    op()  # Warm up caches and lazily built state
+
+    # Size batches to take about BATCH_SECONDS
+    started = time.perf_counter()
+    for _ in range(5):
+        op()
+    once = max((time.perf_counter() - started) / 5, 1e-7)
+    batch = max(1, int(BATCH_SECONDS / once))
+
+    # Like timeit, keep the collector out of the timed batches
+    best = None
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(REPEATS):
+            started = time.perf_counter()
+            for _ in range(batch):
+                op()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        gc.enable()
+
+    # Separate pass: tracing slows everything down, so it is not timed
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for _ in range(min(batch, 50)):
+        op()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"ops_per_sec": batch / best, "us_per_op": best / batch * 1e6,
+            "peak_kib": (peak - base) / 1024.0}
+
+
+def compare(result, baseline):
+    """Change in ops/sec vs the baseline as a fraction, or None."""
+    if not baseline or not baseline.get("ops_per_sec"):
+        return None
+    return result["ops_per_sec"] / baseline["ops_per_sec"] - 1.0
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the game server's hot paths")
+    parser.add_argument("--only", help="run only cases whose name contains this")
+    parser.add_argument("--save", metavar="PATH", help="write results as a baseline JSON file")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=REGRESSION,
+                        help=f"flag cases slower than the baseline by more than this fraction "
+                             f"(default {REGRESSION})")
+    return parser
+
+
+def main():
+    args = build_arg_parser().parse_args()
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    regressions = []
+    print(f"{'case':<14}{'players':>8}{'ops/s':>14}{'us/op':>12}{'peak KiB':>11}{'vs base':>10}")
+    for name, setup, counts in CASES:
+        if args.only and args.only not in name:
+            continue
+        for n in counts:
+            key = f"{name}/{n}"
+            result = run_case(setup, n)
+            results[key] = result
+            change = compare(result, baseline.get(key))
+            shown = "" if change is None else f"{change:+.1%}"
+            if change is not None and change < -args.threshold:
+                regressions.append(key)
+                shown += " !"
+            print(f"{name:<14}{n if n else '-':>8}{result['ops_per_sec']:>14,.0f}"
+                  f"{result['us_per_op']:>12.1f}{result['peak_kib']:>11.1f}{shown:>10}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "results": results}, f, indent=1)
+        print(f"Baseline written to {args.save}")
+    if regressions:
+        print(f"Slower than baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
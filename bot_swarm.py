@@ -0,0 +1,363 @@
+import argparse
+import json
+import math
+import os
+import random
+import socket
+import statistics
+import tempfile
+import threading
+import time
+import urllib.request
+
+import protocol
+import snapshot
+import map_cache
+import map_transfer
+from protocol import FrameReader, MSG_SNAPSHOT
+from protocol import DGRAM_HELLO, DGRAM_POSITION, DGRAM_SNAPSHOT, DGRAM_ACK
+
+# --- HEADLESS LOAD GENERATOR ---
+# Spawns simulated players that speak the real protocol: handshake, map
+# transfer (or cached-map skip), init, then a position stream at a fixed
+# rate while receiving, applying and acking snapshots. Reports what the
+# bots observe (snapshot rate per bot, age of snapshots on arrival) and,
+# with --metrics-port, the server's own broadcast timings.
+#
+#   python bot_swarm.py --bots 64 --rate 30 --pattern wander --udp
+
+PATTERNS = ("wander", "circle", "line", "idle")
+COLORS = ["red", "orange", "yellow", "green", "cyan", "blue", "violet", "pink"]
+SPEED = 6.0  # World units per second, about a running player
+SEND_SLICES = 8  # Bots send in staggered groups, not in lockstep with the server tick
+
+map_lock = threading.Lock()  # One bot downloads the map; the rest find it cached
+
+
+class Stats:
+    """Counters shared by all bots, reset at every report."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failed = 0
+        self.disconnected = 0
+        self.positions = 0
+        self.snapshots = {}  # bot index -> snapshots applied since last report
+        self.ages = []       # Snapshot age on arrival, ms
+        self.resyncs = 0
+
+    def snapshot_received(self, index, age_ms):
+        with self.lock:
+            self.snapshots[index] = self.snapshots.get(index, 0) + 1
+            self.ages.append(age_ms)
+
+    def take(self):
+        """Return and reset the per-interval counters."""
+        with self.lock:
+            taken = (self.positions, self.snapshots, self.ages, self.resyncs)
+            self.positions, self.snapshots, self.ages, self.resyncs = 0, {}, [], 0
+        return taken
+
+
+class Movement:
+    """Position over time for one bot."""
+
+    def __init__(self, pattern, spread):
+        self.pattern = pattern
+        self.spread = spread
+        self.x = random.uniform(-spread, spread)
+        self.z = random.uniform(-spread, spread)
+        self.heading = random.uniform(0, 2 * math.pi)
+        self.radius = random.uniform(5, 30)
+        self.origin = (self.x, self.z)
+        self.last = time.perf_counter()
+
+    def step(self):
+        now = time.perf_counter()
+        dt, self.last = now - self.last, now
+        if self.pattern == "wander":
+            self.heading += random.uniform(-1.5, 1.5) * dt
+            self.x += math.cos(self.heading) * SPEED * dt
+            self.z += math.sin(self.heading) * SPEED * dt
+            # Turn back at the edge of the area
+            if abs(self.x) > self.spread or abs(self.z) > self.spread:
+                self.heading = math.atan2(-self.z, -self.x)
+        elif self.pattern == "circle":
+            self.heading += SPEED / self.radius * dt
+            self.x = self.origin[0] + math.cos(self.heading) * self.radius
+            self.z = self.origin[1] + math.sin(self.heading) * self.radius
+        elif self.pattern == "line":
+            self.heading += SPEED / self.spread * dt
+            self.x = math.sin(self.heading) * self.spread
+        return self.x, 1.0, self.z
+
+
+class Bot:
+    def __init__(self, index, args, stats):
+        self.index = index
+        self.args = args
+        self.stats = stats
+        self.movement = Movement(args.pattern, args.spread)
+        self.receiver = snapshot.SnapshotReceiver()
+        self.send_lock = threading.Lock()
+        self.sock = None
+        self.udp_sock = None
+        self.udp_ready = False
+        self.udp_seq = 0
+        self.alive = False
+
+    # --- Handshake ---
+    def connect(self):
+        self.sock = socket.create_connection((self.args.host, self.args.port), timeout=30)
+        reader = FrameReader(self.sock)
+        hello = reader.read_json()
+        if hello.get("world"):
+            snapshot.set_world_bounds(hello["world"]["min"], hello["world"]["max"])
+        self.fetch_map(reader)
+        protocol.send_json(self.sock, {"type": "init", "name": f"Bot{self.index}",
+                                       "color": random.choice(COLORS)})
+        self.sock.settimeout(None)
+        self.alive = True
+        if self.args.udp and hello.get("udp_port"):
+            self.open_udp(hello)
+        threading.Thread(target=self.listen, args=(reader,), daemon=True).start()
+
+    def fetch_map(self, reader):
+        info = reader.read_json()
+        if not info or not info.get("filename"):
+            return
+        if not self.args.download:
+            with map_lock:
+                if map_cache.lookup(info.get("sha256"), info["filename"]):
+                    protocol.send_json(self.sock, {"type": "map_ready", "have": True})
+                    return
+                os.makedirs(map_cache.CACHE_DIR, exist_ok=True)
+                self.download(reader, info, map_cache.cache_path(info.get("sha256"), info["filename"]))
+            return
+        # --download: every bot pulls the whole map into a throwaway file
+        dest = os.path.join(tempfile.gettempdir(), f"gtamini_bot{self.index}_{os.path.basename(info['filename'])}")
+        try:
+            self.download(reader, info, dest)
+        finally:
+            if os.path.exists(dest):
+                os.remove(dest)
+
+    def download(self, reader, info, dest):
+        offered = info.get("encodings") or {}
+        encoding = next((enc for enc in map_transfer.ENCODINGS if enc in offered), None)
+        manifest = offered[encoding] if encoding else info["manifest"]
+        protocol.send_json(self.sock, {"type": "map_ready", "have": False,
+                                       "encoding": encoding, "offset": 0})
+        if not map_transfer.receive_map(reader, manifest, dest, expected_sha256=info.get("sha256"),
+                                        encoding=encoding):
+            raise ConnectionError("map transfer failed")
+        reader.read_json()  # map_complete
+
+    def open_udp(self, hello):
+        self.udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_sock.connect((self.args.host, hello["udp_port"]))
+        # The server may not have processed our init yet, so retry quickly
+        self.udp_sock.settimeout(0.1)
+        payload = json.dumps({"id": hello["id"], "token": hello.get("token")}).encode()
+        for _ in range(20):
+            try:
+                self.udp_sock.send(protocol.encode_datagram(DGRAM_HELLO, 0, payload))
+                if protocol.decode_datagram(self.udp_sock.recv(65535))[0] == DGRAM_HELLO:
+                    self.udp_ready = True
+                    break
+            except OSError:
+                pass
+        self.udp_sock.settimeout(None)
+        if self.udp_ready:
+            threading.Thread(target=self.udp_listen, daemon=True).start()
+
+    # --- Traffic ---
+    def send_json(self, msg):
+        with self.send_lock:
+            self.sock.sendall(protocol.encode_json(msg))
+
+    def send_position(self):
+        x, y, z = self.movement.step()
+        if self.udp_ready:
+            self.udp_seq += 1
+            self.udp_sock.send(protocol.encode_datagram(
+                DGRAM_POSITION, self.udp_seq, protocol.POSITION_PAYLOAD.pack(x, y, z)))
+        else:
+            self.send_json({"type": "position", "x": x, "y": y, "z": z})
+
+    def handle_snapshot(self, msg, via_udp):
+        state = self.receiver.apply(msg)
+        if state is None:
+            with self.stats.lock:
+                self.stats.resyncs += 1
+            self.send_json({"type": "resync"})
+            return
+        self.stats.snapshot_received(self.index, (time.time() - msg["time"]) * 1000.0)
+        if via_udp:
+            self.udp_sock.send(protocol.encode_datagram(DGRAM_ACK, msg["seq"]))
+        else:
+            self.send_json({"type": "ack", "seq": msg["seq"]})
+
+    def listen(self, reader):
+        try:
+            while True:
+                msg_type, payload = reader.read()
+                if msg_type is None:
+                    break
+                if msg_type == MSG_SNAPSHOT:
+                    self.handle_snapshot(snapshot.decode_snapshot(payload), via_udp=False)
+                # MSG_JSON (meta, leaderboard) needs no handling by a bot
+        except (OSError, protocol.ProtocolError):
+            pass
+        self.alive = False
+        with self.stats.lock:
+            self.stats.disconnected += 1
+
+    def udp_listen(self):
+        while self.alive:
+            try:
+                dgram_type, _, payload = protocol.decode_datagram(self.udp_sock.recv(65535))
+                if dgram_type == DGRAM_SNAPSHOT:
+                    self.handle_snapshot(snapshot.decode_snapshot(payload), via_udp=True)
+            except OSError:
+                return
+            except Exception as e:
+                print(f"Bot {self.index}: bad datagram: {e}")
+
+    def close(self):
+        self.alive = False
+        for s in (self.sock, self.udp_sock):
+            if s:
+                try:
+                    s.close()
+                except OSError:
+                    pass
+
+
+def send_loop(bots, rate, stats, stop):
+    """
+    One thread drives every bot's position stream at `rate` Hz. Each
+    interval is split into SEND_SLICES steps and every bot sends in its own
+    step, so updates reach the server spread out like real clients' would.
+    """
+    interval = 1.0 / (rate * SEND_SLICES)
+    step = 0
+    next_tick = time.perf_counter()
+    while not stop.is_set():
+        sent = 0
+        for bot in list(bots)[step::SEND_SLICES]:
+            if bot.alive:
+                try:
+                    bot.send_position()
+                    sent += 1
+                except OSError:
+                    bot.alive = False
+        with stats.lock:
+            stats.positions += sent
+        step = (step + 1) % SEND_SLICES
+        next_tick += interval
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_tick = time.perf_counter()
+
+
+def server_broadcast_quantiles(metrics_port):
+    """p50/p99 of gtamini_broadcast_seconds from the server's metrics endpoint, in ms."""
+    try:
+        text = urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics", timeout=1).read()
+    except OSError:
+        return None
+    found = {}
+    for line in text.decode().splitlines():
+        if line.startswith('gtamini_broadcast_seconds{quantile="'):
+            quantile = line.split('"')[1]
+            found[quantile] = float(line.rsplit(" ", 1)[1]) * 1000.0
+    return found
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def report(bots, stats, elapsed, interval, metrics_port):
+    positions, snapshots_by_bot, ages, resyncs = stats.take()
+    alive = sum(1 for bot in bots if bot.alive)
+    rates = [snapshots_by_bot.get(bot.index, 0) / interval for bot in bots if bot.alive]
+    line = (f"t={elapsed:5.0f}s bots={alive}/{len(bots)} failed={stats.failed} "
+            f"lost={stats.disconnected} "
+            f"pos/s={positions / interval:.0f} snaps/s={sum(rates):.0f}")
+    if rates:
+        line += f" per-bot={statistics.mean(rates):.1f}Hz (min {min(rates):.1f})"
+    if ages:
+        ages.sort()
+        line += f" age p50={percentile(ages, 0.5):.1f}ms p99={percentile(ages, 0.99):.1f}ms"
+    if resyncs:
+        line += f" resyncs={resyncs}"
+    if metrics_port:
+        quantiles = server_broadcast_quantiles(metrics_port)
+        if quantiles:
+            line += (f" | server broadcast p50={quantiles.get('0.5', 0):.2f}ms"
+                     f" p99={quantiles.get('0.99', 0):.2f}ms")
+    print(line)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Headless bots for load-testing the game server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--bots", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=30.0, help="position updates per second per bot")
+    parser.add_argument("--pattern", choices=PATTERNS, default="wander")
+    parser.add_argument("--spread", type=float, default=150.0,
+                        help="bots move within +/- this many units of the origin")
+    parser.add_argument("--udp", action="store_true", help="use the UDP channel like real clients")
+    parser.add_argument("--download", action="store_true",
+                        help="every bot downloads the map instead of using the cache")
+    parser.add_argument("--spawn-interval", type=float, default=0.05,
+                        help="seconds between bot joins (ramps the load up)")
+    parser.add_argument("--duration", type=float, default=0, help="seconds to run (0 = until Ctrl+C)")
+    parser.add_argument("--report-interval", type=float, default=2.0)
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="also report broadcast times from the server's metrics endpoint")
+    return parser
+
+
+def main():
+    args = build_arg_parser().parse_args()
+    stats = Stats()
+    bots = []
+    stop = threading.Event()
+    threading.Thread(target=send_loop, args=(bots, args.rate, stats, stop), daemon=True).start()
+
+    started = time.perf_counter()
+    next_report = started + args.report_interval
+    next_spawn = started
+    try:
+        while not args.duration or time.perf_counter() - started < args.duration:
+            now = time.perf_counter()
+            if len(bots) < args.bots and now >= next_spawn:
+                bot = Bot(len(bots), args, stats)
+                try:
+                    bot.connect()
+                    bots.append(bot)
+                except (OSError, ValueError, protocol.ProtocolError) as e:
+                    stats.failed += 1
+                    bot.close()
+                    print(f"Bot {bot.index} failed to join: {e}")
+                next_spawn = now + args.spawn_interval
+            if now >= next_report:
+                report(bots, stats, now - started, args.report_interval, args.metrics_port)
+                next_report += args.report_interval
+            time.sleep(0.01)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for bot in bots:
+            bot.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,8 +8,15 @@ from ursina import *
 from ursina.prefabs.first_person_controller import FirstPersonController
 import socket, json, threading, time, random
 import os
-import base64
-import tempfile
+
+import protocol
+import snapshot
+import map_transfer
+import map_cache
+import position_sender
+import interpolation
+from protocol import FrameReader, MSG_JSON, MSG_SNAPSHOT
+from protocol import DGRAM_HELLO, DGRAM_POSITION, DGRAM_SNAPSHOT, DGRAM_ACK
 
 import pause_menu
 import map_loader
@@ -25,12 +32,26 @@ from server_browser import open_server_browser   # ← NEW
 
 # --- GLOBALS ---
 sock = None
+reader = None  # FrameReader for sock (keeps bytes buffered during the handshake)
+send_lock = threading.Lock()  # Listener (acks) and main loop (positions) share sock
+snapshots = snapshot.SnapshotReceiver()
+snapshot_lock = threading.Lock()  # Snapshots may arrive on TCP and UDP
+interp = interpolation.Interpolator()  # Smooths remote players between snapshots; under snapshot_lock
+udp_sock = None
+udp_ready = False     # True once the server echoed our UDP hello
+udp_hello = None      # {"id", "token"} from the handshake
+udp_endpoint = None   # (server ip, udp port)
+udp_seq = 0           # Sequence number of our last position datagram
+positions = position_sender.PositionSender()  # Decides which frames send our position
 USERNAME = ""
 my_id = None
 game_started = False
 server_map_path = None  # Path to map file received from server
+MAP_ATTEMPTS = 5        # Connections tried while a map download keeps breaking off
+MAP_TIMEOUT = 15.0      # Seconds without data before a stalled map download is retried
 
-server_players = {}
+server_players = {}   # pid -> {"x", "y", "z"} from snapshots
+player_meta = {}      # pid -> {"name", "color"}; replaced (not mutated) on change
 
 COLOR_MAP = {
     "red": color.red, "orange": color.orange, "yellow": color.yellow,
@@ -45,34 +66,96 @@ enemies = []  # List of enemy entities
 # ----------------------------------------------------
 # NETWORK LISTENER
 # ----------------------------------------------------
-def listen_thread():
+def handle_snapshot(msg, via_udp=False):
+    """Apply a snapshot message and acknowledge it on the channel it came from."""
     global server_players
+    with snapshot_lock:
+        state = snapshots.apply(msg)
+        if state is not None:
+            interp.push(msg["time"], state["players"], time.perf_counter())
+    if state is None:
+        # Baseline unknown: ask for a full snapshot
+        send_message({"type": "resync"})
+        return
+    server_players = state["players"]
+    if via_udp:
+        send_datagram(DGRAM_ACK, msg["seq"])
+    else:
+        send_message({"type": "ack", "seq": msg["seq"]})
+
+def handle_message(msg):
+    """Handle a reliable JSON message from the server."""
+    if msg.get("type") == "player_meta":
+        for pid, meta in msg.get("players", {}).items():
+            player_meta[pid] = meta
+    elif msg.get("type") == "player_left":
+        player_meta.pop(msg.get("id"), None)
+    elif msg.get("type") == "leaderboard":
+        # Only sent when the ranking changed
+        leaderboard.update_leaderboard_data(msg.get("entries", []))
+
+def listen_thread():
     while True:
         try:
-            data = sock.recv(8192)
-            if not data:
+            msg_type, payload = reader.read()
+            if msg_type is None:
                 break
-            msg = json.loads(data.decode())
-            if msg.get("type") == "players":
-                server_players = msg.get("players", {})
-                # Update leaderboard data
-                if "leaderboard" in msg:
-                    leaderboard.update_leaderboard_data(msg.get("leaderboard", []))
-        except:
-            time.sleep(0.05)
+            if msg_type == MSG_SNAPSHOT:
+                handle_snapshot(snapshot.decode_snapshot(payload))
+            elif msg_type == MSG_JSON:
+                handle_message(protocol.decode_json(payload))
+        except (OSError, protocol.ProtocolError):
+            break
+        except Exception as e:
+            print(f"Bad message from server: {e}")
+
+def udp_listen_thread():
+    """Open the UDP channel, then receive snapshot datagrams."""
+    global udp_ready
+    hello = protocol.encode_datagram(DGRAM_HELLO, 0, json.dumps(udp_hello).encode())
+    udp_sock.settimeout(0.5)
+    for _ in range(10):
+        try:
+            udp_sock.send(hello)
+            data = udp_sock.recv(65535)
+            if protocol.decode_datagram(data)[0] == DGRAM_HELLO:
+                udp_ready = True
+                break
+        except OSError:
+            pass
+    if not udp_ready:
+        print("UDP channel unavailable, using TCP only")
+        return
+    udp_sock.settimeout(None)
+
+    while True:
+        try:
+            data = udp_sock.recv(65535)
+        except OSError:
+            continue
+        try:
+            dgram_type, seq, payload = protocol.decode_datagram(data)
+            if dgram_type == DGRAM_SNAPSHOT:
+                # SnapshotReceiver drops anything older than what we already have
+                handle_snapshot(snapshot.decode_snapshot(payload), via_udp=True)
+        except Exception as e:
+            print(f"Bad datagram from server: {e}")
 
 # ----------------------------------------------------
 # RECEIVE MAP FROM SERVER
 # ----------------------------------------------------
-def receive_map_from_server(sock):
-    """Receive map file from server and save it temporarily"""
+def receive_map_from_server(sock, reader):
+    """
+    Receive the map file from the server into the map cache. Returns its
+    path, None if the server has no map, or False if the download broke
+    off (reconnecting resumes it).
+    """
     global server_map_path
     try:
         # Receive map info message
-        data = sock.recv(4096)
-        info_msg = json.loads(data.decode())
+        info_msg = reader.read_json()
         
-        if info_msg.get("type") == "map_info":
+        if info_msg and info_msg.get("type") == "map_info":
             filename = info_msg.get("filename")
             data_size = info_msg.get("size", 0)
             
@@ -80,67 +163,52 @@ def receive_map_from_server(sock):
                 print("No map file available from server")
                 return None
             
-            print(f"Receiving map file: {filename} ({data_size} bytes)...")
+            sha256 = info_msg.get("sha256")
+            # Not cacheable unless it's a real digest; nothing to verify against either
+            sha256 = sha256.lower() if map_cache.valid_sha256(sha256) else None
+            cached = map_cache.lookup(sha256, filename)
+            if cached:
+                # Same content as a map we already have: skip the download
+                protocol.send_json(sock, {"type": "map_ready", "have": True})
+                server_map_path = cached
+                print(f"Using cached map: {server_map_path}")
+                return server_map_path
             
-            # Send ready signal
-            sock.sendall(b"OK")
+            # Ask for a compressed stream if the server offers one we can decode
+            offered = info_msg.get("encodings") or {}
+            encoding = next((enc for enc in map_transfer.ENCODINGS if enc in offered), None)
+            manifest = offered[encoding] if encoding else info_msg["manifest"]
             
-            # Receive base64 data in chunks
-            received = b""
-            buffer = b""
-            while len(received) < data_size:
-                # Check if we have leftover data in buffer
-                if buffer:
-                    needed = data_size - len(received)
-                    if len(buffer) <= needed:
-                        received += buffer
-                        buffer = b""
-                    else:
-                        received += buffer[:needed]
-                        buffer = buffer[needed:]
-                        break
-                
-                chunk = sock.recv(8192)
-                if not chunk:
-                    break
-                
-                if len(received) + len(chunk) <= data_size:
-                    received += chunk
-                else:
-                    # Chunk contains both data and completion message
-                    needed = data_size - len(received)
-                    received += chunk[:needed]
-                    buffer = chunk[needed:]
+            os.makedirs(map_cache.CACHE_DIR, exist_ok=True)
+            map_path = map_cache.cache_path(sha256, filename)
+            part_path = map_cache.part_path(map_path, encoding)
+            offset = map_transfer.resume_offset(part_path, manifest)
             
-            # Check buffer for completion message
-            if buffer:
-                try:
-                    complete_msg = json.loads(buffer.decode())
-                    if complete_msg.get("type") == "map_complete":
-                        pass  # Success
-                except:
-                    pass  # Not JSON, ignore
+            print(f"Receiving map file: {filename} ({manifest['size']} bytes, "
+                  f"{encoding or 'uncompressed'}, from byte {offset})...")
             
-            # Decode base64 and save
-            try:
-                map_data = base64.b64decode(received.decode('utf-8'))
-                
-                # Save to temporary file
-                temp_dir = os.path.join(tempfile.gettempdir(), "gtamini_maps")
-                os.makedirs(temp_dir, exist_ok=True)
-                server_map_path = os.path.join(temp_dir, filename)
-                
-                with open(server_map_path, 'wb') as f:
-                    f.write(map_data)
-                
-                print(f"Map file saved to: {server_map_path}")
-                return server_map_path
-            except Exception as e:
-                print(f"Error decoding map data: {e}")
-                return None
+            # Send ready signal
+            protocol.send_json(sock, {"type": "map_ready", "have": False,
+                                      "encoding": encoding, "offset": offset})
+            
+            # Raw file bytes follow; each chunk is checked before it is kept
+            ok = map_transfer.receive_map(reader, manifest, map_path, part_path, sha256,
+                                          on_progress=loading.set_progress,
+                                          encoding=encoding, offset=offset)
+            complete = reader.read_json() if ok else None
+            if not complete or complete.get("type") != "map_complete":
+                return False
+            map_cache.evict(keep=map_path)
+            
+            server_map_path = map_path
+            print(f"Map file saved to: {server_map_path}")
+            return server_map_path
         else:
             print("Unexpected message type from server")
             return None
+    except OSError as e:
+        print(f"Map download interrupted: {e}")
+        return False
     except Exception as e:
         print(f"Error receiving map from server: {e}")
         import traceback
@@ -150,45 +218,71 @@ def receive_map_from_server(sock):
 # ----------------------------------------------------
 # CONNECT TO SERVER (used by server browser)
 # ----------------------------------------------------
-def connect_to_server(ip):
-    global USERNAME, server_map_path
+def connect_to_server(ip, port=9999):
+    global USERNAME, server_map_path, udp_hello, udp_endpoint
     USERNAME = f"Player{random.randint(1000,9999)}"
     picked_color = random.choice(list(COLOR_MAP.keys()))
 
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((ip, 9999))
-
-        # Receive player ID
-        data = s.recv(4096)
-        pid = json.loads(data.decode())["id"]
-        
-        # Receive map file from server
-        server_map_path = receive_map_from_server(s)
+        for attempt in range(MAP_ATTEMPTS):
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.connect((ip, port))
+
+            # Receive player ID
+            r = FrameReader(s)
+            hello = r.read_json()
+            pid = hello["id"]
+            if hello.get("world"):
+                # Snapshot positions are fixed point over the server's bounds
+                snapshot.set_world_bounds(hello["world"]["min"], hello["world"]["max"])
+            if hello.get("udp_port"):
+                udp_hello = {"id": pid, "token": hello.get("token")}
+                udp_endpoint = (ip, hello["udp_port"])
+            
+            # Receive map file from server. A link that stalls without closing
+            # times out (an OSError), which counts as interrupted and resumes
+            s.settimeout(MAP_TIMEOUT)
+            server_map_path = receive_map_from_server(s, r)
+            if server_map_path is not False:
+                s.settimeout(None)
+                break
+            # Download broke off: reconnect and resume from the verified part
+            s.close()
+            print(f"Reconnecting to resume map download ({attempt + 1}/{MAP_ATTEMPTS})...")
+        else:
+            raise ConnectionError("Map download kept failing")
 
         # Send info
         init = {"name": USERNAME, "color": picked_color}
-        s.sendall(json.dumps(init).encode())
+        protocol.send_json(s, init)
 
-        return s, pid, USERNAME, picked_color
+        return s, r, pid, USERNAME, picked_color
     except Exception as e:
         print("Failed connection:", e)
         import traceback
         traceback.print_exc()
-        return None, None, None, None
+        return None, None, None, None, None
 
 # ----------------------------------------------------
 # GAME START
 # ----------------------------------------------------
-def start_game(connection_sock, player_id, username, selected_color):
-    global sock, my_id, USERNAME, game_started, player
+def start_game(connection_sock, connection_reader, player_id, username, selected_color):
+    global sock, reader, my_id, USERNAME, game_started, player, udp_sock
 
     sock = connection_sock
+    reader = connection_reader
     my_id = player_id
     USERNAME = username
     game_started = True
+    positions.reset()
+    with snapshot_lock:
+        interp.reset()
 
     threading.Thread(target=listen_thread, daemon=True).start()
+    if udp_endpoint:
+        udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp_sock.connect(udp_endpoint)
+        threading.Thread(target=udp_listen_thread, daemon=True).start()
 
     try:
         # Lighting & sky
@@ -239,17 +333,17 @@ def start_game(connection_sock, player_id, username, selected_color):
 # ----------------------------------------------------
 # SERVER BROWSER CALLBACK
 # ----------------------------------------------------
-def on_server_selected(ip):
+def on_server_selected(ip, port=9999):
     """Called when player clicks a server."""
     # Show loading UI and connect in background so the UI thread doesn't hang.
     loading.show_loading_screen("Connecting to server")
 
     def _connect():
-        s, pid, username, color = connect_to_server(ip)
+        s, r, pid, username, color = connect_to_server(ip, port)
         if s:
             # Run start_game on the main thread
             from ursina import invoke
-            invoke(lambda: start_game(s, pid, username, color))
+            invoke(lambda: start_game(s, r, pid, username, color))
         else:
             print("Connection failed.")
             # Restore UI: hide loading and reopen browser so user isn't stuck on gray screen
@@ -262,37 +356,85 @@ def on_server_selected(ip):
 # ----------------------------------------------------
 # UPDATE LOOP
 # ----------------------------------------------------
+def apply_meta(remote, meta):
+    """Update a remote player's label and color; only called when its metadata changed."""
+    remote["meta"] = meta
+    if meta is None:
+        return
+    remote["entity"].color = COLOR_MAP.get(meta.get("color"), color.red)
+    remote["label"].text = meta.get("name","")
+
 def create_remote(pid, pdata):
-    ent = Entity(model='cube', scale=1.2, color=COLOR_MAP.get(pdata["color"], color.red))
+    ent = Entity(model='cube', scale=1.2, color=color.red)
     ent.position = Vec3(pdata["x"], pdata["y"], pdata["z"])
-    label = Text(text=pdata.get("name",""), origin=(0,0), world_space=True, scale=1)
+    label = Text(text="", origin=(0,0), world_space=True, scale=1)
     label.position = ent.position + Vec3(0,1.2,0)
-    return {"entity": ent, "label": label}
+    remote = {"entity": ent, "label": label, "meta": None}
+    apply_meta(remote, player_meta.get(pid))
+    return remote
 
 def update_remote_players():
-    for pid, pdata in server_players.items():
+    # Draw everyone slightly in the past, between snapshots (see interpolation)
+    players = server_players
+    now = time.perf_counter()
+    with snapshot_lock:
+        poses = {pid: interp.sample(pid, now) for pid in players if pid != my_id}
+    for pid, pdata in players.items():
         if pid == my_id: continue
         if pid not in other_players:
             other_players[pid] = create_remote(pid, pdata)
-        else:
-            other_players[pid]["entity"].position = Vec3(pdata["x"], pdata["y"], pdata["z"])
-            other_players[pid]["label"].position = Vec3(pdata["x"], pdata["y"]+1.2, pdata["z"])
-            other_players[pid]["label"].text = pdata.get("name","")
+        pose = poses.get(pid)
+        if pose is not None:
+            x, y, z, yaw = pose
+            other_players[pid]["entity"].position = Vec3(x, y, z)
+            other_players[pid]["label"].position = Vec3(x, y+1.2, z)
+            if yaw is not None:
+                other_players[pid]["entity"].rotation_y = yaw
+        # Metadata dicts are replaced on change, so identity tells us if it changed
+        meta = player_meta.get(pid)
+        if meta is not other_players[pid]["meta"]:
+            apply_meta(other_players[pid], meta)
+    # Players that disconnected or left our interest area
     for pid in list(other_players.keys()):
-        if pid not in server_players:
+        if pid not in players:
             destroy(other_players[pid]["entity"])
-            other_players[pid]["label"].enabled = False
+            destroy(other_players[pid]["label"])
             del other_players[pid]
 
-def send_position():
-    if player is None or sock is None:
+def send_message(msg):
+    if sock is None:
         return
-    pos = {"type":"position", "x":player.x, "y":player.y, "z":player.z}
     try:
-        sock.sendall(json.dumps(pos).encode())
+        with send_lock:
+            protocol.send_json(sock, msg)
     except:
         pass
 
+def send_datagram(dgram_type, seq, payload=b""):
+    try:
+        udp_sock.send(protocol.encode_datagram(dgram_type, seq, payload))
+    except:
+        pass
+
+def send_position():
+    """Send our position if it changed enough, rate-limited (see position_sender)."""
+    global udp_seq
+    if player is None or sock is None:
+        return
+    update = positions.update(time.perf_counter(), player.x, player.y, player.z, player.rotation_y)
+    if update is None:
+        return
+    if udp_ready:
+        udp_seq += 1
+        if "yaw" in update:
+            payload = protocol.MOTION_PAYLOAD.pack(update["x"], update["y"], update["z"], update["vx"],
+                                                   update["vy"], update["vz"], update["yaw"])
+        else:
+            payload = protocol.POSITION_PAYLOAD.pack(update["x"], update["y"], update["z"])
+        send_datagram(DGRAM_POSITION, udp_seq, payload)
+    else:
+        send_message({"type": "position", **update})
+
 def update():
     # Update loading screen animation if visible
     if loading.loading_text:
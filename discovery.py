@@ -0,0 +1,86 @@
+import json
+import socket
+import threading
+
+import protocol
+from protocol import DGRAM_BEACON
+
+# --- LAN DISCOVERY ---
+# Servers broadcast a small beacon every BEACON_INTERVAL seconds to
+# DISCOVERY_PORT: a DGRAM_BEACON datagram whose payload is the server's
+# status plus its game port. Server browsers listen on that port and see
+# servers appear within one interval, without probing every address.
+
+DISCOVERY_PORT = 9998
+BEACON_INTERVAL = 1.0  # Seconds; 0 disables beacons
+BEACON_TIMEOUT = 5.0   # Browsers forget servers whose beacons stop this long
+HOTSPOT_BROADCAST = "192.168.137.255"  # Windows mobile hotspot subnet
+
+
+def beacon_targets(local_ip):
+    """
+    Addresses to broadcast to. 255.255.255.255 only leaves through one
+    interface, so the local /24 and the hotspot subnet are added explicitly.
+    """
+    targets = ["255.255.255.255", HOTSPOT_BROADCAST]
+    if local_ip and not local_ip.startswith("127."):
+        targets.append(".".join(local_ip.split(".")[:3]) + ".255")
+    return targets
+
+
+def make_beacon_socket():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    s.setblocking(False)
+    return s
+
+
+def send_beacon(sock, seq, port, status, targets):
+    """Broadcast one beacon. Unreachable targets (e.g. no hotspot) are skipped."""
+    payload = dict(status, port=port)
+    data = protocol.encode_datagram(
+        DGRAM_BEACON, seq, json.dumps(payload, separators=(",", ":")).encode())
+    for target in targets:
+        try:
+            sock.sendto(data, (target, DISCOVERY_PORT))
+        except OSError:
+            pass
+
+
+class BeaconListener:
+    """Receives beacons on a thread and calls `on_server(ip, status)` for each."""
+
+    def __init__(self, on_server, port=DISCOVERY_PORT):
+        self.on_server = on_server
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Several games on one machine can all listen
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.bind(("", port))
+        self.running = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def _run(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except OSError:
+                return  # Socket closed by stop()
+            dgram_type, _, payload = protocol.decode_datagram(data)
+            if dgram_type != DGRAM_BEACON:
+                continue
+            try:
+                status = json.loads(payload.decode())
+            except ValueError:
+                continue
+            if not isinstance(status, dict):
+                continue  # Valid JSON, but not a status object
+            self.on_server(addr[0], status)
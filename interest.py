@@ -0,0 +1,72 @@
+from collections import defaultdict
+
+# --- INTEREST MANAGEMENT ---
+# Each client only receives players near it, plus a few always-relevant
+# ones (itself and the top of the leaderboard). Nearby players are found
+# with a uniform grid over the x/z plane, so a query only looks at the
+# cells around the client instead of every player on the map.
+
+INTEREST_RADIUS = 80.0  # World units; 0 disables filtering
+LEAVE_FACTOR = 1.2      # A player leaves the view only past radius * factor
+ALWAYS_TOP = 3          # Leaderboard places that everyone always receives
+
+
+class SpatialGrid:
+    """Uniform spatial hash of player positions on the x/z plane."""
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)  # (cx, cz) -> [(pid, x, z)]
+
+    def _cell(self, x, z):
+        return int(x // self.cell_size), int(z // self.cell_size)
+
+    def insert(self, pid, x, z):
+        self.cells[self._cell(x, z)].append((pid, x, z))
+
+    def query(self, x, z, radius):
+        """Return the ids of players within `radius` of (x, z)."""
+        found = []
+        r2 = radius * radius
+        cx0, cz0 = self._cell(x - radius, z - radius)
+        cx1, cz1 = self._cell(x + radius, z + radius)
+        for cx in range(cx0, cx1 + 1):
+            for cz in range(cz0, cz1 + 1):
+                for pid, px, pz in self.cells.get((cx, cz), ()):
+                    dx, dz = px - x, pz - z
+                    if dx * dx + dz * dz <= r2:
+                        found.append(pid)
+        return found
+
+
+def build_grid(players, radius=INTEREST_RADIUS):
+    """Index a {pid: {"x", "z", ...}} dict. Cells are one radius wide."""
+    grid = SpatialGrid(radius)
+    for pid, pdata in players.items():
+        grid.insert(pid, pdata["x"], pdata["z"])
+    return grid
+
+
+def relevant_players(grid, players, always, pid, previous=None, radius=INTEREST_RADIUS):
+    """
+    Ids the client `pid` should receive: players near it plus the ids in
+    `always` (e.g. the top of the leaderboard). Players already in `previous`
+    stay until they are past the leave radius, so views don't flicker.
+    """
+    me = players.get(pid)
+    if me is None:
+        return frozenset()
+    view = set(grid.query(me["x"], me["z"], radius))
+    if previous:
+        leave_radius = radius * LEAVE_FACTOR
+        leave_r2 = leave_radius * leave_radius
+        for other in previous:
+            if other in view or other not in players:
+                continue
+            dx = players[other]["x"] - me["x"]
+            dz = players[other]["z"] - me["z"]
+            if dx * dx + dz * dz <= leave_r2:
+                view.add(other)
+    view.add(pid)
+    view.update(other for other in always if other in players)
+    return frozenset(view)
@@ -0,0 +1,104 @@
+from collections import deque
+
+# --- SNAPSHOT INTERPOLATION ---
+# Remote players are drawn INTERP_DELAY seconds in the past, between the
+# two buffered snapshots around that moment, so they move smoothly however
+# far apart snapshots arrive. If the next snapshot is late, players that
+# report a velocity are extrapolated for at most MAX_EXTRAPOLATION seconds,
+# then eased back to their last sample over the same time, rather than
+# jumping there. Everyone else is drawn at their last sample: the server
+# stops sending snapshots when a player stops moving, so a guessed velocity
+# would carry them past where they stopped.
+#
+# Snapshot times come from the server clock; the offset to the local clock
+# is tracked from arrival times, so the clocks need not agree.
+
+INTERP_DELAY = 0.1        # Seconds; about two ticks at 20 Hz
+MAX_EXTRAPOLATION = 0.25  # Seconds past the newest snapshot
+BUFFER_SIZE = 32          # Samples kept per player
+OFFSET_DRIFT = 0.01       # How fast the clock offset follows slower arrivals
+
+
+def _lerp(a, b, t):
+    return a + (b - a) * t
+
+
+def _lerp_angle(a, b, t):
+    """Interpolate between angles in degrees the short way round."""
+    return a + ((b - a + 180.0) % 360.0 - 180.0) * t
+
+
+class Interpolator:
+    """
+    Per-player buffers of (server time, x, y, z, velocity, yaw) samples.
+    push() is called for every snapshot state and sample() every frame,
+    with `now` from the same local clock (e.g. time.perf_counter()).
+    """
+
+    def __init__(self, delay=None, extrapolation=None):
+        self.delay = INTERP_DELAY if delay is None else delay
+        self.extrapolation = MAX_EXTRAPOLATION if extrapolation is None else extrapolation
+        self.buffers = {}   # pid -> deque of samples, oldest first
+        self.offset = None  # Local time minus server time, for the fastest arrivals
+        self.latest = None  # Server time of the newest snapshot pushed
+
+    def push(self, server_time, players, now):
+        """Buffer a snapshot state's players; players missing from it are dropped."""
+        if self.latest is not None and server_time <= self.latest:
+            return  # Stale or duplicate snapshot
+        self.latest = server_time
+
+        # Late packets only raise the offset slowly, early ones lower it at once
+        offset = now - server_time
+        if self.offset is None or offset < self.offset:
+            self.offset = offset
+        else:
+            self.offset += (offset - self.offset) * OFFSET_DRIFT
+
+        for pid, pdata in players.items():
+            buf = self.buffers.get(pid)
+            if buf is None:
+                buf = self.buffers[pid] = deque(maxlen=BUFFER_SIZE)
+            velocity = (pdata["vx"], pdata["vy"], pdata["vz"]) if "vx" in pdata else None
+            buf.append((server_time, pdata["x"], pdata["y"], pdata["z"], velocity, pdata.get("yaw")))
+        for pid in [pid for pid in self.buffers if pid not in players]:
+            del self.buffers[pid]
+
+    def sample(self, pid, now):
+        """(x, y, z, yaw) for `pid` at local time `now`, or None if unknown. yaw may be None."""
+        buf = self.buffers.get(pid)
+        if not buf:
+            return None
+        t = now - self.offset - self.delay
+
+        # Drop samples older than needed, leaving the pair around t in front
+        while len(buf) > 2 and buf[1][0] <= t:
+            buf.popleft()
+
+        a = buf[0]
+        if t <= a[0]:
+            return a[1], a[2], a[3], a[5]
+        if len(buf) == 1 or t >= buf[-1][0]:
+            return self._extrapolate(buf, t)
+        b = buf[1]
+        f = (t - a[0]) / (b[0] - a[0])
+        yaw = _lerp_angle(a[5], b[5], f) if a[5] is not None and b[5] is not None else b[5]
+        return _lerp(a[1], b[1], f), _lerp(a[2], b[2], f), _lerp(a[3], b[3], f), yaw
+
+    def _extrapolate(self, buf, t):
+        last = buf[-1]
+        dt = t - last[0]
+        velocity = last[4]
+        limit = self.extrapolation
+        if velocity is None or dt >= 2 * limit:
+            return last[1], last[2], last[3], last[5]
+        if dt > limit:
+            # Past the window: ease back from the furthest point, no jump
+            dt = limit * (2 - dt / limit)
+        return (last[1] + velocity[0] * dt, last[2] + velocity[1] * dt,
+                last[3] + velocity[2] * dt, last[5])
+
+    def reset(self):
+        self.buffers.clear()
+        self.offset = None
+        self.latest = None
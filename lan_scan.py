@@ -0,0 +1,246 @@
+import asyncio
+import ipaddress
+import json
+import os
+import random
+import socket
+import statistics
+import tempfile
+import threading
+import time
+
+import protocol
+from protocol import DGRAM_STATUS, DGRAM_PING
+
+# --- LAN SCAN ---
+# Fallback for when discovery beacons don't get through: probe addresses
+# with DGRAM_STATUS queries. One asyncio loop on a background thread sends
+# from a single UDP socket, with at most SCAN_CONCURRENCY probes in flight,
+# and reports servers as soon as they answer. Recently joined servers are
+# kept on disk ("ip:port") and probed first, on the port they were joined on.
+#
+# Latency is measured the same way with DGRAM_PING, which the server echoes
+# without doing anything else.
+
+PORT = 9999
+SCAN_TIMEOUT = 0.25      # Seconds to wait for each reply
+SCAN_CONCURRENCY = 64    # Probes in flight at once
+EXTRA_RANGES = ["192.168.137.0/24"]  # Windows mobile hotspot subnet
+RECENT_PATH = os.path.join(tempfile.gettempdir(), "gtamini_servers.json")
+RECENT_MAX = 16
+PING_SAMPLES = 5         # Round trips per server; the median is reported
+PING_GAP = 0.02          # Seconds between samples to the same server
+
+
+def local_ranges():
+    """The local /24 plus EXTRA_RANGES, as CIDR strings."""
+    ranges = list(EXTRA_RANGES)
+    try:
+        local_ip = socket.gethostbyname(socket.gethostname())
+        ranges.insert(0, str(ipaddress.ip_network(local_ip + "/24", strict=False)))
+    except (OSError, ValueError):
+        pass
+    return ranges
+
+
+def parse_address(text, default_port=None):
+    """(ip, port) from "ip" or "ip:port"; port is `default_port` if not given."""
+    ip, sep, port = text.strip().rpartition(":")
+    if not sep:
+        return port, default_port
+    try:
+        return ip, int(port)
+    except ValueError:
+        return text.strip(), default_port
+
+
+def iter_targets(ranges, first=()):
+    """
+    (ip, port) pairs to probe: the "ip[:port]" strings in `first`, then
+    every host in the CIDR `ranges`, once each. port is None for the
+    scanner's default.
+    """
+    seen = set()
+    for address in first:
+        ip, port = parse_address(address)
+        target = (ip, None if port == PORT else port)
+        if target not in seen:
+            seen.add(target)
+            yield target
+    for cidr in ranges:
+        for host in ipaddress.ip_network(cidr, strict=False).hosts():
+            target = (str(host), None)
+            if target not in seen:
+                seen.add(target)
+                yield target
+
+
+def load_recent():
+    """Recently joined server addresses ("ip:port"), newest first."""
+    try:
+        with open(RECENT_PATH) as f:
+            recent = json.load(f)
+        return [ip for ip in recent if isinstance(ip, str)][:RECENT_MAX]
+    except (OSError, ValueError, TypeError):
+        return []
+
+
+def remember_server(ip, port=None):
+    address = f"{ip}:{port or PORT}"
+    recent = [address] + [other for other in load_recent()
+                          if parse_address(other, PORT) != (ip, port or PORT)]
+    try:
+        with open(RECENT_PATH, 'w') as f:
+            json.dump(recent[:RECENT_MAX], f)
+    except OSError:
+        pass
+
+
+class _ProbeProtocol(asyncio.DatagramProtocol):
+    """Resolves the pending probe whose type and seq match each reply."""
+
+    def __init__(self):
+        self.pending = {}  # seq -> (dgram_type, addr, future)
+
+    def datagram_received(self, data, addr):
+        dgram_type, seq, payload = protocol.decode_datagram(data)
+        if dgram_type is None:
+            return  # Too short to be a reply
+        pending = self.pending.get(seq)
+        if pending is None:
+            return
+        expected, probed, future = pending
+        # Only the probed server can answer; anyone else guessing seqs is ignored
+        if dgram_type != expected or addr[:2] != probed or future.done():
+            return
+        future.set_result(payload)
+
+    async def request(self, transport, dgram_type, addr, timeout):
+        """Send one probe and return the reply payload. Raises TimeoutError."""
+        loop = asyncio.get_running_loop()
+        seq = random.getrandbits(32)
+        future = loop.create_future()
+        self.pending[seq] = (dgram_type, addr, future)
+        try:
+            transport.sendto(protocol.encode_datagram(dgram_type, seq), addr)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(seq, None)
+
+    def error_received(self, exc):
+        # ICMP port unreachable from hosts without a server
+        pass
+
+
+class LanScanner:
+    """
+    Probes `targets` ((ip, port) pairs, see iter_targets) on a background
+    thread. `on_found(ip, status)` is called from that thread for every
+    server that answers, with the port it answered on in status["port"],
+    and `on_done()` once the scan ends (also after cancel()).
+    """
+
+    def __init__(self, targets, on_found, on_done=None, concurrency=None, timeout=None, port=None):
+        self.targets = iter(targets)
+        self.on_found = on_found
+        self.on_done = on_done
+        self.concurrency = concurrency or SCAN_CONCURRENCY
+        self.timeout = timeout or SCAN_TIMEOUT
+        self.port = port or PORT
+        self.cancelled = False
+        self._loop = None
+        self._task = None
+        threading.Thread(target=self._thread, daemon=True).start()
+
+    def cancel(self):
+        self.cancelled = True
+        loop, task = self._loop, self._task
+        if loop and task:
+            loop.call_soon_threadsafe(task.cancel)
+
+    def _thread(self):
+        try:
+            asyncio.run(self._run())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if self.on_done:
+                self.on_done()
+
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        if self.cancelled:
+            return
+        transport, probes = await self._loop.create_datagram_endpoint(
+            _ProbeProtocol, local_addr=("0.0.0.0", 0))
+        try:
+            workers = [self._worker(transport, probes) for _ in range(self.concurrency)]
+            await asyncio.gather(*workers)
+        finally:
+            transport.close()
+
+    async def _worker(self, transport, probes):
+        # Workers share one target iterator, so memory stays flat for big ranges
+        for ip, port in self.targets:
+            if self.cancelled:
+                return
+            port = port or self.port
+            try:
+                reply = await probes.request(transport, DGRAM_STATUS, (ip, port), self.timeout)
+                status = json.loads(reply.decode())
+            except (asyncio.TimeoutError, OSError, ValueError):
+                continue
+            if not isinstance(status, dict):
+                continue
+            status["port"] = port
+            self.on_found(ip, status)
+
+
+async def _median_rtt(transport, probes, addr, samples, timeout):
+    """Median round-trip time to `addr` in milliseconds, or None if nothing came back."""
+    rtts = []
+    for i in range(samples):
+        if i:
+            await asyncio.sleep(PING_GAP)
+        started = time.perf_counter()
+        try:
+            await probes.request(transport, DGRAM_PING, addr, timeout)
+        except (asyncio.TimeoutError, OSError):
+            continue
+        rtts.append((time.perf_counter() - started) * 1000.0)
+    return statistics.median(rtts) if rtts else None
+
+
+def measure_rtts(addrs, on_result, samples=None, timeout=None):
+    """
+    Ping every server in `addrs` ((ip, port) pairs) at once on a background
+    thread and call `on_result(addr, rtt_ms)` from that thread as each
+    finishes (None if it never answered).
+    """
+    samples = samples or PING_SAMPLES
+    timeout = timeout or SCAN_TIMEOUT
+
+    async def run():
+        transport, probes = await asyncio.get_running_loop().create_datagram_endpoint(
+            _ProbeProtocol, local_addr=("0.0.0.0", 0))
+
+        async def one(addr):
+            on_result(addr, await _median_rtt(transport, probes, addr, samples, timeout))
+
+        try:
+            await asyncio.gather(*(one(addr) for addr in addrs))
+        finally:
+            transport.close()
+
+    threading.Thread(target=asyncio.run, args=(run(),), daemon=True).start()
+
+
+def scan_lan(ranges=None, first=None):
+    """Blocking scan of `ranges` (default: local_ranges()). Returns [(ip, status)]; see LanScanner."""
+    found = []
+    done = threading.Event()
+    targets = iter_targets(ranges or local_ranges(), first or load_recent())
+    LanScanner(targets, lambda ip, status: found.append((ip, status)), done.set)
+    done.wait()
+    return found
@@ -7,6 +7,8 @@ leaderboard_panel = None
 leaderboard_title = None
 leaderboard_entries = []  # List of Text entities for each entry
 _visible = False  # Track whether the board is currently shown
+_data_version = 0  # Bumped whenever new data arrives from the server
+_rendered_version = None  # Data version the entries currently show
 
 # --- LEADERBOARD SETUP ---
 def setup_leaderboard(player_id):
@@ -55,16 +57,21 @@ def setup_leaderboard(player_id):
 # --- LEADERBOARD UPDATE ---
 def update_leaderboard_data(new_leaderboard):
     """Update leaderboard data from server"""
-    global leaderboard_data
+    global leaderboard_data, _data_version
     leaderboard_data = new_leaderboard if new_leaderboard else []
+    _data_version += 1
 
 def update_leaderboard():
-    """Update leaderboard display"""
-    global leaderboard_entries, leaderboard_data, my_id
+    """Update leaderboard display (only re-renders new data while the board is shown)"""
+    global leaderboard_entries, leaderboard_data, my_id, _rendered_version
     
     if not leaderboard_entries:
         return  # Not initialized yet
     
+    if not _visible or _rendered_version == _data_version:
+        return  # Nothing new to show, or nobody is looking
+    _rendered_version = _data_version
+    
     if not leaderboard_data:
         # Clear all entries if no data
         for entry in leaderboard_entries:
@@ -107,8 +114,10 @@ def update_leaderboard():
 # --- LEADERBOARD TOGGLE (optional, for hiding/showing) ---
 def set_visible(visible):
     """Show or hide leaderboard"""
-    global leaderboard_panel, leaderboard_title, leaderboard_entries, _visible
+    global leaderboard_panel, leaderboard_title, leaderboard_entries, _visible, _rendered_version
     _visible = visible
+    # Entries get re-enabled below, so redraw them on the next update
+    _rendered_version = None
     if leaderboard_panel:
         leaderboard_panel.enabled = visible
     if leaderboard_title:
@@ -6,10 +6,12 @@ loading_text = None
 loading_sub = None
 loading_spinner = None
 loading_dots = ""
+loading_progress = None  # Latest download progress, set from the network thread
 
 def show_loading_screen(message="Loading..."):
     """Show a loading screen with a message."""
-    global loading_panel, loading_text, loading_sub, loading_spinner, loading_dots
+    global loading_panel, loading_text, loading_sub, loading_spinner, loading_dots, loading_progress
+    loading_progress = None
     
     # Dark background panel
     loading_panel = Entity(
@@ -70,6 +72,21 @@ def show_loading_screen(message="Loading..."):
     
     loading_dots = ""
 
+def set_progress(progress):
+    """
+    Report download progress (a map_transfer.TransferProgress). Safe to call
+    from any thread; the text is updated on the next update_loading_screen().
+    """
+    global loading_progress
+    loading_progress = (progress.received, progress.total, progress.rate(), progress.eta())
+
+def format_progress(received, total, rate, eta):
+    """e.g. '12.3 / 27.0 MB  4.1 MB/s  ETA 4s'"""
+    text = f"{received / 1e6:.1f} / {total / 1e6:.1f} MB  {rate / 1e6:.1f} MB/s"
+    if eta is not None and received < total:
+        text += f"  ETA {eta:.0f}s"
+    return text
+
 def update_loading_screen(message=None):
     """Update the loading screen message with animated dots."""
     global loading_text, loading_sub, loading_spinner, loading_dots
@@ -89,7 +106,10 @@ def update_loading_screen(message=None):
         loading_spinner.text = "." * len(loading_dots) if loading_dots else ""
 
     if loading_sub:
-        loading_sub.text = "Still working"
+        if loading_progress:
+            loading_sub.text = format_progress(*loading_progress)
+        else:
+            loading_sub.text = "Still working"
 
     if loading_spinner:
         palette = [color.azure, color.cyan, color.lime, color.yellow, color.orange, color.violet]
@@ -98,7 +118,8 @@ def update_loading_screen(message=None):
 
 def hide_loading_screen():
     """Hide and destroy the loading screen."""
-    global loading_panel, loading_text, loading_sub, loading_spinner, loading_dots
+    global loading_panel, loading_text, loading_sub, loading_spinner, loading_dots, loading_progress
+    loading_progress = None
     
     if loading_panel:
         destroy(loading_panel)
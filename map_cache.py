@@ -0,0 +1,89 @@
+import os
+import re
+import tempfile
+
+import map_transfer
+
+# --- CLIENT MAP CACHE ---
+# Downloaded maps are stored under their SHA-256, so a map the server
+# advertises can be looked up before downloading it again. The directory
+# is bounded by size; the least recently used maps are evicted first
+# (file mtime is bumped on every use). Interrupted downloads leave a ".part"
+# file here that the next attempt resumes from. The hash comes from the
+# server, so anything but 64 hex digits is not used as a file name: such a
+# map is downloaded under its base name and never looked up.
+
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "gtamini_maps")
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+
+def valid_sha256(sha256):
+    """True if `sha256` is a hex SHA-256 digest that is safe to use as a file name."""
+    return isinstance(sha256, str) and re.fullmatch(r"[0-9a-fA-F]{64}", sha256) is not None
+
+
+def cache_path(sha256, filename):
+    """Where the map with this hash lives. Keeps the extension for map_loader."""
+    ext = os.path.splitext(os.path.basename(filename or ""))[1].lower()
+    if valid_sha256(sha256):
+        return os.path.join(CACHE_DIR, sha256.lower() + ext)
+    # Not cacheable: never let the server's file name leave CACHE_DIR
+    name = os.path.basename(filename or "")
+    if name in ("", ".", ".."):
+        name = "map" + ext
+    return os.path.join(CACHE_DIR, name)
+
+
+def part_path(map_path, encoding=None):
+    """Where a partial download of `map_path` is kept so it can be resumed."""
+    return map_path + map_transfer.EXTENSIONS.get(encoding, "") + ".part"
+
+
+def lookup(sha256, filename):
+    """Return the cached map's path (and mark it recently used), or None."""
+    if not valid_sha256(sha256):
+        return None
+    path = cache_path(sha256, filename)
+    if not os.path.isfile(path):
+        return None
+    touch(path)
+    return path
+
+
+def touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def evict(keep=None, max_bytes=None):
+    """Delete least recently used files until the cache fits in `max_bytes`."""
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    try:
+        names = os.listdir(CACHE_DIR)
+    except OSError:
+        return
+    entries = []
+    total = 0
+    for name in names:
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        total += st.st_size
+        entries.append((st.st_mtime, st.st_size, path))
+
+    entries.sort()  # Oldest use first
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        if keep and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        try:
+            os.remove(path)
+            total -= size
+            print(f"Evicted cached map {os.path.basename(path)}")
+        except OSError:
+            pass
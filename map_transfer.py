@@ -0,0 +1,227 @@
+import hashlib
+import lzma
+import os
+import time
+import zlib
+
+import protocol
+
+# --- CLIENT MAP DOWNLOAD ---
+# Receives the raw map stream that follows a map_info message and writes it
+# to disk as it arrives: one reusable buffer, an incremental SHA-256, and a
+# progress callback. Nothing here depends on ursina, so headless tools can
+# download maps too.
+#
+# The stream may be compressed: the server precompresses the map once with
+# compress_file(), and the client decompresses it chunk by chunk, checking
+# the hash against the decompressed file.
+#
+# Transfers are resumable. map_info carries a manifest of the stream: its
+# size, chunk size and the CRC-32 of every chunk. The client keeps the raw
+# stream in a ".part" file, appending only chunks that pass their check, so
+# after a dropped connection it asks the server to continue from the end of
+# the verified prefix.
+
+CHUNK_SIZE = 256 * 1024  # Also the manifest chunk size
+PROGRESS_INTERVAL = 0.1  # Seconds between progress callbacks
+
+ENCODINGS = ("zlib", "lzma")                   # Supported, in order of preference
+EXTENSIONS = {"zlib": ".z", "lzma": ".xz"}     # Suffix of the precompressed file
+COMPRESSION = "zlib"  # What the server precompresses the map with ("none" to disable)
+COMPRESS_LEVEL = 6
+
+
+def make_compressor(encoding, level):
+    if encoding == "zlib":
+        return zlib.compressobj(level)
+    if encoding == "lzma":
+        return lzma.LZMACompressor(preset=level)
+    raise ValueError(f"Unknown map encoding: {encoding}")
+
+
+def make_decompressor(encoding):
+    if encoding == "zlib":
+        return zlib.decompressobj()
+    if encoding == "lzma":
+        return lzma.LZMADecompressor()
+    raise ValueError(f"Unknown map encoding: {encoding}")
+
+
+def compress_file(src_path, dest_path, encoding, level):
+    """Compress `src_path` into `dest_path` in chunks. Returns the compressed size."""
+    compressor = make_compressor(encoding, level)
+    tmp_path = dest_path + ".tmp"
+    with open(src_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            dst.write(compressor.compress(chunk))
+        dst.write(compressor.flush())
+    os.replace(tmp_path, dest_path)
+    return os.path.getsize(dest_path)
+
+
+def chunk_crcs(path, chunk_size=CHUNK_SIZE):
+    """CRC-32 of each `chunk_size` piece of a file, for the transfer manifest."""
+    with open(path, 'rb') as f:
+        return [zlib.crc32(chunk) for chunk in iter(lambda: f.read(chunk_size), b'')]
+
+
+def make_manifest(path, chunk_size=CHUNK_SIZE):
+    return {"size": os.path.getsize(path), "chunk_size": chunk_size,
+            "crcs": chunk_crcs(path, chunk_size)}
+
+
+def resume_offset(part_path, manifest):
+    """
+    Length of the prefix of an earlier partial download that matches the
+    manifest, in whole chunks. Anything after it is cut off the file.
+    """
+    size, chunk_size = manifest["size"], manifest["chunk_size"]
+    try:
+        f = open(part_path, 'r+b')
+    except OSError:
+        return 0
+    offset = 0
+    with f:
+        for crc in manifest["crcs"]:
+            chunk = f.read(chunk_size)
+            if len(chunk) != min(chunk_size, size - offset) or zlib.crc32(chunk) != crc:
+                break
+            offset += len(chunk)
+        f.truncate(offset)
+    return offset
+
+
+class TransferProgress:
+    """Tracks bytes received and derives throughput and ETA."""
+
+    def __init__(self, total, received=0):
+        self.total = total
+        self.received = received
+        self.resumed_at = received  # Bytes that came from an earlier attempt
+        self.started = time.perf_counter()
+
+    def rate(self):
+        """Average bytes per second so far."""
+        elapsed = time.perf_counter() - self.started
+        return (self.received - self.resumed_at) / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """Seconds left at the current rate, or None if unknown."""
+        rate = self.rate()
+        if rate <= 0:
+            return None
+        return (self.total - self.received) / rate
+
+
+class _Output:
+    """Turns stream bytes into the map file: decompresses, hashes, writes."""
+
+    def __init__(self, dest_path, part_path, encoding):
+        self.encoding = encoding
+        self.digest = hashlib.sha256()
+        self.decompressor = make_decompressor(encoding) if encoding else None
+        # An uncompressed stream is the map itself, so the .part file is the output
+        self.path = dest_path + ".tmp" if encoding else part_path
+        self.file = open(self.path, 'wb') if encoding else None
+
+    def feed(self, data):
+        if self.decompressor:
+            data = self.decompressor.decompress(data)
+            self.file.write(data)
+        self.digest.update(data)
+
+    def finish(self):
+        """Flush the decompressor. Returns False if the stream was cut short."""
+        if not self.decompressor:
+            return True
+        if self.encoding == "zlib":
+            tail = self.decompressor.flush()
+            self.file.write(tail)
+            self.digest.update(tail)
+        self.file.close()
+        return self.decompressor.eof
+
+    def discard(self):
+        if self.file:
+            self.file.close()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def receive_map(reader, manifest, dest_path, part_path=None, expected_sha256=None,
+                on_progress=None, encoding=None, offset=0):
+    """
+    Stream the map from `reader` (a protocol.FrameReader) into `dest_path`.
+    `manifest` describes the stream ({"size", "chunk_size", "crcs"});
+    `offset` bytes of it are already in `part_path` (see resume_offset) and
+    the server sends the rest. Each chunk is checked against its CRC before
+    it is appended to the .part file. `encoding` names the compression of
+    the stream, if any. Once complete, the (decompressed) file is checked
+    against `expected_sha256` and moved into place.
+    `on_progress(progress)` is called periodically with a TransferProgress.
+    Returns True on success; on failure the verified prefix stays in
+    `part_path` so the next attempt can resume.
+    """
+    size, chunk_size, crcs = manifest["size"], manifest["chunk_size"], manifest["crcs"]
+    if not 0 < chunk_size <= protocol.MAX_PAYLOAD:
+        raise protocol.ProtocolError(f"Bad map chunk size: {chunk_size}")
+    part_path = part_path or dest_path + ".part"
+    progress = TransferProgress(size, offset)
+    last_report = 0.0
+    output = _Output(dest_path, part_path, encoding)
+
+    try:
+        with open(part_path, 'r+b' if offset else 'wb') as part:
+            # Replay the verified prefix so the hash and decompressor catch up
+            remaining = offset
+            while remaining:
+                data = part.read(min(CHUNK_SIZE, remaining))
+                output.feed(data)
+                remaining -= len(data)
+
+            buf = bytearray(min(chunk_size, max(size, 1)))
+            view = memoryview(buf)
+            pos = offset
+            while pos < size:
+                want = min(chunk_size, size - pos)
+                n = reader.read_raw_into(view[:want])
+                if n < want:
+                    break  # Connection closed mid-chunk; the partial chunk is dropped
+                if zlib.crc32(view[:want]) != crcs[pos // chunk_size]:
+                    print(f"Map chunk {pos // chunk_size} failed its checksum")
+                    break
+                part.write(view[:want])
+                part.flush()
+                output.feed(view[:want])
+                pos += want
+                progress.received = pos
+                now = time.perf_counter()
+                if on_progress and now - last_report >= PROGRESS_INTERVAL:
+                    last_report = now
+                    on_progress(progress)
+    except BaseException:
+        # e.g. a socket timeout; the verified prefix stays in the .part file
+        output.discard()
+        raise
+
+    if on_progress:
+        on_progress(progress)
+    if progress.received != size or not output.finish():
+        print(f"Incomplete map transfer ({progress.received}/{size} bytes)")
+        output.discard()
+        return False
+    if expected_sha256 and output.digest.hexdigest() != expected_sha256:
+        print("Map file failed its integrity check")
+        output.discard()
+        os.remove(part_path)  # Start over next time
+        return False
+
+    os.replace(output.path, dest_path)
+    if encoding:
+        os.remove(part_path)
+    print(f"Received map in {time.perf_counter() - progress.started:.2f}s "
+          f"({progress.rate() / 1e6:.1f} MB/s"
+          + (f", resumed at {offset} bytes)" if offset else ")"))
+    return True
@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- SERVER METRICS ---
+# Cheap in-process instrumentation, exposed in the Prometheus text format on
+# an optional local HTTP endpoint (server --metrics-port). Timings are kept
+# as summaries: quantiles over the most recent WINDOW samples plus running
+# _sum/_count totals, so rates and averages can be derived by the scraper.
+
+WINDOW = 2048  # Samples kept per summary for quantiles
+QUANTILES = (0.5, 0.9, 0.99)
+METRICS_PORT = 0  # 0 = no endpoint
+
+
+class Summary:
+    """Timing (or other) samples: recent-window quantiles and lifetime sum/count."""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.samples = deque(maxlen=WINDOW)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.samples.append(value)
+            self.sum += value
+            self.count += 1
+
+    def render(self):
+        with self._lock:
+            samples = sorted(self.samples)
+            total, count = self.sum, self.count
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} summary"]
+        for q in QUANTILES:
+            value = samples[min(int(q * len(samples)), len(samples) - 1)] if samples else float("nan")
+            lines.append(f'{self.name}{{quantile="{q}"}} {value:.9g}')
+        lines.append(f"{self.name}_sum {total:.9g}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+class Counters:
+    """Monotonic counters keyed by a tuple of label values."""
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self.values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in values:
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+TICK_INTERVAL = Summary("gtamini_tick_interval_seconds", "Time between the starts of consecutive ticks")
+BROADCAST = Summary("gtamini_broadcast_seconds", "Time spent in broadcast_players per tick")
+LOCK_WAIT = Summary("gtamini_lock_wait_seconds", "Time spent waiting to acquire server.LOCK")
+LOCK_HOLD = Summary("gtamini_lock_hold_seconds", "Time server.LOCK was held per acquisition")
+MAP_TRANSFER = Summary("gtamini_map_transfer_seconds", "Duration of each map transfer")
+MAP_THROUGHPUT = Summary("gtamini_map_transfer_bytes_per_second", "Throughput of each map transfer")
+MESSAGES = Counters("gtamini_messages_total", "Messages handled, by direction and type",
+                    ("direction", "type"))
+MAP_BYTES = Counters("gtamini_map_bytes_sent_total", "Map bytes sent, by encoding", ("encoding",))
+
+SUMMARIES = [TICK_INTERVAL, BROADCAST, LOCK_WAIT, LOCK_HOLD, MAP_TRANSFER, MAP_THROUGHPUT]
+COUNTERS = [MESSAGES, MAP_BYTES]
+
+
+class TimedLock:
+    """A threading.Lock that records how long callers wait for it and hold it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._acquired_at = 0.0
+
+    def acquire(self):
+        started = time.perf_counter()
+        self._lock.acquire()
+        self._acquired_at = time.perf_counter()
+        LOCK_WAIT.observe(self._acquired_at - started)
+        return True
+
+    def release(self):
+        # Recorded while still holding the lock, so _acquired_at is ours
+        LOCK_HOLD.observe(time.perf_counter() - self._acquired_at)
+        self._lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def record_map_transfer(sent, seconds, encoding):
+    MAP_BYTES.inc(encoding or "identity", amount=sent)
+    MAP_TRANSFER.observe(seconds)
+    if seconds > 0:
+        MAP_THROUGHPUT.observe(sent / seconds)
+
+
+def render(extra_lines=()):
+    """The whole exposition text. `extra_lines` are appended as-is."""
+    lines = []
+    for summary in SUMMARIES:
+        lines.extend(summary.render())
+    for counters in COUNTERS:
+        lines.extend(counters.render())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
+
+
+def serve(port, collect=None):
+    """
+    Serve /metrics on 127.0.0.1:`port` from a background thread.
+    `collect()` returns extra exposition lines (e.g. per-client gauges).
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = render(collect() if collect else ()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes would flood the console
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    print(f"Metrics on http://127.0.0.1:{port}/metrics")
+    return httpd
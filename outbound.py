@@ -0,0 +1,161 @@
+import asyncio
+import socket
+import threading
+from collections import deque
+
+# --- OUTBOUND QUEUES ---
+# Each client gets its own queue drained by a writer (thread or asyncio
+# task), so a client with a full TCP window only stalls itself. Snapshots
+# are "droppable": every snapshot is a delta against the client's last ack,
+# so skipping an older queued one loses nothing once a newer one is sent.
+
+QUEUE_MAX_BYTES = 256 * 1024  # Per-client cap on queued, unsent bytes
+DROP_OLDEST = "drop_oldest"   # Over the cap: discard oldest queued snapshots
+DISCONNECT = "disconnect"     # Over the cap: drop the client
+QUEUE_POLICY = DROP_OLDEST
+
+
+class OutboundQueue:
+    """Byte-capped FIFO of frames waiting to be written to one client."""
+
+    def __init__(self, max_bytes=None, policy=None):
+        # Read the module settings at creation so command-line overrides apply
+        self.max_bytes = max_bytes if max_bytes is not None else QUEUE_MAX_BYTES
+        self.policy = policy or QUEUE_POLICY
+        self.items = deque()  # (data, droppable)
+        self.bytes = 0
+        self.dropped = 0      # Snapshots discarded because the client lagged
+        self.closed = False
+
+    def push(self, data, droppable=False):
+        """Queue a frame. Returns False if the client should be disconnected."""
+        if self.closed:
+            return False
+        self.items.append((data, droppable))
+        self.bytes += len(data)
+        if self.bytes <= self.max_bytes:
+            return True
+        if self.policy == DROP_OLDEST:
+            # Never drop the newest snapshot, even with reliable frames queued
+            # after it: the server won't send that seq to this client again
+            newest = None
+            for i, (_, item_droppable) in enumerate(self.items):
+                if item_droppable:
+                    newest = i
+            kept = deque()
+            for i, (old, old_droppable) in enumerate(self.items):
+                if self.bytes > self.max_bytes and old_droppable and i != newest:
+                    self.bytes -= len(old)
+                    self.dropped += 1
+                else:
+                    kept.append((old, old_droppable))
+            self.items = kept
+            # Reliable messages alone over the cap means they are piling up
+            reliable = sum(len(data) for data, item_droppable in self.items if not item_droppable)
+            return reliable <= self.max_bytes or len(self.items) == 1
+        return False
+
+    def pop(self):
+        """Return the next frame, or None if the queue is empty."""
+        if not self.items:
+            return None
+        data, _ = self.items.popleft()
+        self.bytes -= len(data)
+        return data
+
+    def depth(self):
+        return {"messages": len(self.items), "bytes": self.bytes, "dropped": self.dropped}
+
+
+class ThreadedSender:
+    """Outbound queue for a blocking socket, drained by its own writer thread."""
+
+    def __init__(self, conn, max_bytes=None, policy=None):
+        self.conn = conn
+        self.queue = OutboundQueue(max_bytes, policy)
+        self.bytes_sent = 0  # Written to the socket so far, for metrics
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def send(self, data, droppable=False):
+        with self._cond:
+            if self.queue.closed:
+                return  # Already disconnecting; frames racing the close are dropped
+            ok = self.queue.push(data, droppable)
+            self._cond.notify()
+        if not ok:
+            print("Client fell too far behind, disconnecting")
+            self.close()
+
+    def depth(self):
+        with self._cond:
+            return self.queue.depth()
+
+    def close(self):
+        with self._cond:
+            self.queue.closed = True
+            self._cond.notify()
+        try:
+            # Wakes the client's reader thread so it cleans up
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self.queue.items and not self.queue.closed:
+                    self._cond.wait()
+                if self.queue.closed:
+                    return
+                data = self.queue.pop()
+            try:
+                self.conn.sendall(data)
+                self.bytes_sent += len(data)
+            except OSError:
+                self.close()
+                return
+
+
+class AsyncSender:
+    """Outbound queue for an asyncio StreamWriter, drained by a writer task."""
+
+    def __init__(self, writer, max_bytes=None, policy=None):
+        self.writer = writer
+        self.queue = OutboundQueue(max_bytes, policy)
+        self.bytes_sent = 0  # Handed to the transport so far, for metrics
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def send(self, data, droppable=False):
+        if self.queue.closed:
+            return  # Already disconnecting; frames racing the close are dropped
+        if not self.queue.push(data, droppable):
+            print("Client fell too far behind, disconnecting")
+            self.close()
+            return
+        self._wakeup.set()
+
+    def depth(self):
+        return self.queue.depth()
+
+    def close(self):
+        self.queue.closed = True
+        self._wakeup.set()
+        # Closing the transport ends the client's read loop
+        self.writer.close()
+
+    async def _run(self):
+        try:
+            while not self.queue.closed:
+                data = self.queue.pop()
+                if data is None:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                self.writer.write(data)
+                self.bytes_sent += len(data)
+                # Waits while the socket is backed up; the queue absorbs the rest
+                await self.writer.drain()
+        except ConnectionError:
+            self.close()
@@ -0,0 +1,87 @@
+import math
+
+import snapshot
+
+# --- POSITION SEND RATE ---
+# The client samples its position every rendered frame but only sends it
+# when something changed enough to matter, at most SEND_RATE times a
+# second. A player standing still sends a keep-alive every
+# KEEPALIVE_INTERVAL so the server still hears from it. Changes below the
+# snapshot resolution are never worth a packet.
+
+SEND_RATE = 20.0                           # Max updates per second while moving
+KEEPALIVE_INTERVAL = 1.0                   # Seconds between updates while idle
+POSITION_EPSILON = None                    # World units; None = one snapshot step
+ROTATION_EPSILON = 1.0                     # Degrees
+VELOCITY_EPSILON = 0.25                    # Units per second
+SEND_MOTION = True                         # Include velocity and facing
+
+
+def _angle_delta(a, b):
+    """Smallest difference between two angles in degrees."""
+    return abs((a - b + 180.0) % 360.0 - 180.0)
+
+
+class PositionSender:
+    """
+    Decides which frames send a position update. Call update() once per
+    frame; it returns the update to send ({"x", "y", "z"} plus "vx", "vy",
+    "vz", "yaw" when motion is included) or None.
+    """
+
+    def __init__(self, rate=None, keepalive=None, motion=None):
+        self.interval = 1.0 / (rate or SEND_RATE)
+        self.keepalive = keepalive or KEEPALIVE_INTERVAL
+        self.motion = SEND_MOTION if motion is None else motion
+        self.sent = None         # Last update sent
+        self.sent_at = None
+        self.frame = None        # (time, x, y, z) of the previous frame
+        self.velocity = (0.0, 0.0, 0.0)
+        self.count = 0           # Updates sent
+
+    def _track_velocity(self, now, x, y, z):
+        if self.frame is not None:
+            dt = now - self.frame[0]
+            if dt > 0:
+                self.velocity = ((x - self.frame[1]) / dt, (y - self.frame[2]) / dt,
+                                 (z - self.frame[3]) / dt)
+        self.frame = (now, x, y, z)
+
+    def _changed(self, update):
+        sent = self.sent
+        # Snapshot resolution depends on the server's world bounds
+        epsilon = POSITION_EPSILON or 1.0 / snapshot.POS_SCALE
+        if any(abs(update[axis] - sent[axis]) >= epsilon for axis in snapshot.POSITION_FIELDS):
+            return True
+        if not self.motion:
+            return False
+        if _angle_delta(update["yaw"], sent["yaw"]) >= ROTATION_EPSILON:
+            return True
+        # Starting and stopping change the velocity without moving much yet
+        return any(abs(update[axis] - sent[axis]) >= VELOCITY_EPSILON
+                   for axis in snapshot.VELOCITY_FIELDS)
+
+    def update(self, now, x, y, z, yaw=0.0):
+        """The update to send at time `now` (seconds), or None to skip this frame."""
+        self._track_velocity(now, x, y, z)
+        if self.sent_at is not None and now - self.sent_at < self.interval:
+            return None
+        update = {"x": x, "y": y, "z": z}
+        if self.motion:
+            vx, vy, vz = self.velocity
+            update.update(vx=vx, vy=vy, vz=vz, yaw=yaw % 360.0)
+        if not all(math.isfinite(v) for v in update.values()):
+            return None
+        if self.sent is not None and now - self.sent_at < self.keepalive and not self._changed(update):
+            return None
+        self.sent = update
+        self.sent_at = now
+        self.count += 1
+        return update
+
+    def reset(self):
+        """Forget what was sent, so the next frame sends (e.g. after reconnecting)."""
+        self.sent = None
+        self.sent_at = None
+        self.frame = None
+        self.velocity = (0.0, 0.0, 0.0)
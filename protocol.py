@@ -0,0 +1,196 @@
+import json
+import struct
+
+# --- WIRE FORMAT ---
+# Every message on the TCP stream is a frame:
+#   [payload length: uint32][message type: uint8][payload]
+# so several messages arriving in one recv() (or one message split across
+# several) are decoded correctly.
+#
+# The one exception is the map file: after a map_info message announcing its
+# size and hash, the file's raw bytes follow unframed (so the server can
+# sendfile() them straight from disk), then a map_complete message.
+HEADER = struct.Struct("!IB")
+MAX_PAYLOAD = 16 * 1024 * 1024
+
+# Message types
+MSG_JSON = 1      # UTF-8 JSON object
+MSG_SNAPSHOT = 3  # Binary snapshot (see snapshot.SnapshotEncoder)
+
+RECV_BUFFER_SIZE = 64 * 1024
+
+# --- DATAGRAMS ---
+# High-rate, loss-tolerant traffic (positions, snapshots) also travels over
+# UDP as single datagrams: [datagram type: uint8][sequence: uint32][payload].
+# Receivers drop anything not newer than the last sequence they accepted.
+DGRAM_HEADER = struct.Struct("!BI")
+MAX_DATAGRAM = 1200   # Bytes; stays under a typical MTU so datagrams are never
+                      # IP-fragmented (one lost fragment loses all). Larger snapshots use TCP
+SEQ_MOD = 1 << 32
+POSITION_PAYLOAD = struct.Struct("!fff")  # x, y, z
+MOTION_PAYLOAD = struct.Struct("!fffffff")  # x, y, z, vx, vy, vz, yaw (degrees)
+
+DGRAM_HELLO = 1     # Client -> server {"id", "token"}; server echoes it back
+DGRAM_POSITION = 2  # Client -> server position update (POSITION_PAYLOAD or MOTION_PAYLOAD)
+DGRAM_SNAPSHOT = 3  # Server -> client binary snapshot (seq = snapshot seq)
+DGRAM_ACK = 4       # Client -> server snapshot ack (seq = acked snapshot seq)
+DGRAM_STATUS = 5    # Anyone -> server status query; the reply has the same seq and a JSON status
+DGRAM_BEACON = 6    # Server -> LAN broadcast on the discovery port: JSON status + game port
+DGRAM_PING = 7      # Anyone -> server; echoed back unchanged to measure round-trip time
+
+
+class ProtocolError(Exception):
+    """Raised when the peer sends a malformed frame."""
+
+
+def encode_frame(msg_type, payload):
+    """Build a single frame from a message type and payload bytes."""
+    return HEADER.pack(len(payload), msg_type) + payload
+
+
+def encode_json(obj):
+    """Build a JSON frame."""
+    return encode_frame(MSG_JSON, json.dumps(obj, separators=(",", ":")).encode())
+
+
+def decode_json(payload):
+    """Decode the payload of a JSON frame."""
+    return json.loads(payload.decode())
+
+
+def send_json(sock, obj):
+    """Send a JSON message as a single frame."""
+    sock.sendall(encode_json(obj))
+
+
+def encode_datagram(dgram_type, seq, payload=b""):
+    """Build a datagram with a type and sequence number."""
+    return DGRAM_HEADER.pack(dgram_type, seq % SEQ_MOD) + payload
+
+
+def decode_datagram(data):
+    """Return (dgram_type, seq, payload), or (None, None, None) if too short."""
+    if len(data) < DGRAM_HEADER.size:
+        return None, None, None
+    dgram_type, seq = DGRAM_HEADER.unpack_from(data)
+    return dgram_type, seq, data[DGRAM_HEADER.size:]
+
+
+def seq_newer(seq, last):
+    """True if `seq` is newer than `last`, allowing for 32-bit wraparound."""
+    if last is None:
+        return True
+    return seq != last and ((seq - last) % SEQ_MOD) < SEQ_MOD // 2
+
+
+class FrameDecoder:
+    """
+    Incremental frame decoder over a reusable bytearray.
+
+    Bytes are written straight into the buffer with `recv_into` (or `feed`),
+    and complete frames are popped with `next_frame`. Partial frames stay in
+    the buffer until the rest arrives.
+    """
+
+    def __init__(self, size=RECV_BUFFER_SIZE):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0  # first unread byte
+        self._end = 0    # one past the last received byte
+
+    def buffered(self):
+        """Number of received bytes not yet consumed."""
+        return self._end - self._start
+
+    def _make_room(self, needed):
+        """Ensure at least `needed` bytes of free space after `_end`."""
+        if self._start == self._end:
+            self._start = self._end = 0
+        if len(self._buf) - self._end >= needed:
+            return
+        pending = self._end - self._start
+        if self._start:
+            # Move unread bytes to the front of the buffer
+            self._view[:pending] = self._view[self._start:self._end]
+            self._start, self._end = 0, pending
+        if len(self._buf) - self._end < needed:
+            # Frame larger than the buffer: grow it
+            self._view.release()
+            self._buf.extend(bytes(pending + needed - len(self._buf)))
+            self._view = memoryview(self._buf)
+
+    def recv_into(self, sock):
+        """Receive directly into the buffer. Returns bytes read (0 on EOF)."""
+        self._make_room(4096)
+        n = sock.recv_into(self._view[self._end:])
+        self._end += n
+        return n
+
+    def feed(self, data):
+        """Append bytes obtained elsewhere."""
+        self._make_room(len(data))
+        self._view[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def drain_into(self, view):
+        """Move up to len(view) buffered bytes into `view`. Returns the count."""
+        n = min(len(view), self._end - self._start)
+        view[:n] = self._view[self._start:self._start + n]
+        self._start += n
+        return n
+
+    def next_frame(self):
+        """Return (msg_type, payload) for the next complete frame, or None."""
+        if self._end - self._start < HEADER.size:
+            return None
+        length, msg_type = HEADER.unpack_from(self._buf, self._start)
+        if length > MAX_PAYLOAD:
+            raise ProtocolError(f"Frame too large: {length} bytes")
+        begin = self._start + HEADER.size
+        if self._end - begin < length:
+            # Make sure the whole frame will fit once it arrives
+            self._make_room(length - (self._end - begin))
+            return None
+        payload = bytes(self._view[begin:begin + length])
+        self._start = begin + length
+        return msg_type, payload
+
+
+class FrameReader:
+    """Blocking frame reader for a socket."""
+
+    def __init__(self, sock, size=RECV_BUFFER_SIZE):
+        self.sock = sock
+        self.decoder = FrameDecoder(size)
+
+    def read(self):
+        """Return the next (msg_type, payload), or (None, None) on EOF."""
+        while True:
+            frame = self.decoder.next_frame()
+            if frame is not None:
+                return frame
+            if self.decoder.recv_into(self.sock) == 0:
+                return None, None
+
+    def read_raw_into(self, view):
+        """
+        Fill `view` with the next len(view) raw (unframed) bytes. Bytes already
+        buffered are copied first; the rest is received straight into `view`.
+        Returns the number of bytes read, which is short only on EOF.
+        """
+        pos = self.decoder.drain_into(view)
+        while pos < len(view):
+            n = self.sock.recv_into(view[pos:])
+            if n == 0:
+                break
+            pos += n
+        return pos
+
+    def read_json(self):
+        """Return the next JSON message, skipping other frame types. None on EOF."""
+        while True:
+            msg_type, payload = self.read()
+            if msg_type is None:
+                return None
+            if msg_type == MSG_JSON:
+                return decode_json(payload)
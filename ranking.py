@@ -0,0 +1,59 @@
+import bisect
+
+# --- SERVER-SIDE RANKING ---
+# The leaderboard is kept sorted as players join, leave and score, instead
+# of being rebuilt and re-sorted every tick. `version` changes whenever the
+# order, a score or a name changes, so the server only sends a leaderboard
+# message when there is something new.
+
+
+class Ranking:
+    """Players ordered by score (highest first), ties broken by join order."""
+
+    def __init__(self):
+        self._keys = []     # Sorted [(-score, join_order, pid)]
+        self._entries = {}  # pid -> [key, name]
+        self._joins = 0
+        self.version = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, pid, name, score=0):
+        if pid in self._entries:
+            self.remove(pid)
+        key = (-score, self._joins, pid)
+        self._joins += 1
+        bisect.insort(self._keys, key)
+        self._entries[pid] = [key, name]
+        self.version += 1
+
+    def remove(self, pid):
+        entry = self._entries.pop(pid, None)
+        if entry is None:
+            return
+        del self._keys[bisect.bisect_left(self._keys, entry[0])]
+        self.version += 1
+
+    def set_score(self, pid, score):
+        entry = self._entries.get(pid)
+        if entry is None or -entry[0][0] == score:
+            return
+        del self._keys[bisect.bisect_left(self._keys, entry[0])]
+        entry[0] = (-score, entry[0][1], pid)
+        bisect.insort(self._keys, entry[0])
+        self.version += 1
+
+    def rename(self, pid, name):
+        entry = self._entries.get(pid)
+        if entry is None or entry[1] == name:
+            return
+        entry[1] = name
+        self.version += 1
+
+    def top_ids(self, n):
+        return [key[2] for key in self._keys[:n]]
+
+    def entries(self):
+        """[[pid, name, score], ...] in rank order, as sent to clients."""
+        return [[key[2], self._entries[key[2]][1], -key[0]] for key in self._keys]
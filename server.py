@@ -4,15 +4,51 @@ import json
 import random
 import time
 import os
-import base64
+import hashlib
+import argparse
+import secrets
+import math
+import traceback
 
-LOCK = threading.Lock()
-clients = {}        # player_id -> {"conn": conn, "addr": addr}
-players = {}        # player_id -> {"x":..., "y":..., "z":..., "name":..., "color":..., "score":...}
+import protocol
+import snapshot
+import outbound
+import interest
+import ranking
+import map_transfer
+import discovery
+import metrics
+from protocol import FrameReader, MSG_JSON, MSG_SNAPSHOT
+from protocol import DGRAM_HELLO, DGRAM_POSITION, DGRAM_SNAPSHOT, DGRAM_ACK, DGRAM_STATUS
+from protocol import DGRAM_PING
+
+LOCK = metrics.TimedLock()  # A threading.Lock that also records wait/hold times
+clients = {}        # player_id -> {"out", "addr", "acked", "sent", "sent_tcp", "views", "token", "udp_addr",
+                    #               "udp_seq", "tcp_in", "udp_in", "udp_out"} (byte counters)
+udp_clients = {}    # (ip, port) -> player_id, for clients whose UDP channel is up
+udp_sock = None     # UDP socket (or asyncio datagram transport) on the game port
+udp_port = None
+players = {}        # player_id -> {"x":..., "y":..., "z":..., "name":..., "color":...}
 scores = {}         # player_id -> score count
-next_id = 0
-map_data = None     # Map file data (loaded once on server start)
+leaderboard = ranking.Ranking()  # Kept sorted incrementally as scores change
+leaderboard_sent_version = None  # Ranking version last sent to clients
+next_id = 0         # Where the search for a free player id starts
+ids_in_use = set()  # Player ids held by open connections
+MAX_PLAYER_IDS = 1 << 16  # Snapshots carry ids as u16
+snapshot_seq = 0    # Sequence number of the newest snapshot
+snapshot_history = {}  # seq -> snapshot state, kept as delta baselines
+map_path = None     # Map file on disk (streamed to clients, never held in memory)
 map_filename = None # Map filename
+map_size = 0
+map_sha256 = None   # Hex digest, lets clients verify the download
+map_manifest = None # Size, chunk size and chunk CRCs of the map, for resumable transfers
+map_encoded = {}    # encoding -> (path, manifest) of the precompressed map
+
+TICK_RATE = 30      # Snapshots broadcast per second (e.g. 20/30/60)
+started_at = time.time()  # Reset when the server starts; reported as uptime
+tick_stats = {"rate": TICK_RATE, "avg_ms": 0.0, "overruns": 0, "last_start": None}  # Reported in status replies
+DGRAM_NAMES = {DGRAM_HELLO: "hello", DGRAM_POSITION: "position", DGRAM_ACK: "ack",
+               DGRAM_STATUS: "status", DGRAM_PING: "ping"}  # Metric labels
 
 COLOR_POOL = [
     "red","orange","yellow","green","cyan","blue","violet","pink"
@@ -29,35 +65,344 @@ def get_local_ip():
         s.close()
     return ip
 
+def build_snapshot_state(players):
+    """
+    Snapshot state (positions only) from a copy of `players`. Names and colors
+    go out once in player_meta messages, the leaderboard in its own message.
+    """
+    positions = {}
+    for pid, pdata in players.items():
+        # Quantize up front: movement below the wire resolution is not a change
+        entry = {axis: snapshot.quantize(pdata[axis]) for axis in snapshot.POSITION_FIELDS}
+        if "vx" in pdata:
+            for axis in snapshot.VELOCITY_FIELDS:
+                entry[axis] = snapshot.quantize_velocity(pdata[axis])
+        if "yaw" in pdata:
+            entry["yaw"] = snapshot.quantize_yaw(pdata["yaw"])
+        positions[pid] = entry
+    return {"players": positions}
+
 def broadcast_players():
+    """Send each client a delta against the last snapshot it acknowledged."""
+    global snapshot_seq, leaderboard_sent_version
+    # Critical section: shallow copies only. Player dicts are replaced, never
+    # mutated, when updated (see apply_position), so sharing them is safe.
     with LOCK:
-        # Include scores in player data
-        players_with_scores = {}
-        for pid, pdata in players.items():
-            players_with_scores[pid] = pdata.copy()
-            players_with_scores[pid]["score"] = scores.get(pid, 0)
-        
-        data = json.dumps({
-            "type": "players",
-            "players": players_with_scores,
-            "leaderboard": sorted([(pid, players[pid]["name"], scores.get(pid, 0)) for pid in players.keys()], 
-                                 key=lambda x: x[2], reverse=True)
-        }).encode()
-        
-        removed = []
-        for pid, info in clients.items():
-            try:
-                info["conn"].sendall(data)
-            except:
-                removed.append(pid)
-        for r in removed:
-            if r in clients: del clients[r]
-            if r in players: del players[r]
-            if r in scores: del scores[r]
+        current_players = players.copy()
+        targets = list(clients.items())
+        always_relevant = leaderboard.top_ids(interest.ALWAYS_TOP)
+        ranking_entries = None
+        if leaderboard.version != leaderboard_sent_version:
+            # Only rebuilt when the order, a score or a name changed
+            leaderboard_sent_version = leaderboard.version
+            ranking_entries = leaderboard.entries()
+
+    if ranking_entries is not None:
+        frame = protocol.encode_json({"type": "leaderboard", "version": leaderboard_sent_version,
+                                      "entries": ranking_entries})
+        for pid, info in targets:
+            info["out"].send(frame)
+        metrics.MESSAGES.inc("out", "leaderboard", amount=len(targets))
+
+    # Building, diffing and encoding happen outside the lock. Only this
+    # thread writes snapshot_seq/snapshot_history.
+    state = build_snapshot_state(current_players)
+    # Only start a new snapshot when something changed, so idle rooms send nothing
+    if snapshot_seq not in snapshot_history or snapshot_history[snapshot_seq] != state:
+        snapshot_history[snapshot_seq + 1] = state
+        snapshot_history.pop(snapshot_seq + 1 - snapshot.HISTORY_SIZE, None)
+        snapshot_seq += 1
+
+    encoder = snapshot.SnapshotEncoder(snapshot_seq, state, snapshot_history, time.time())
+    grid = interest.build_grid(state["players"], interest.INTEREST_RADIUS) if interest.INTEREST_RADIUS else None
+
+    # Each distinct (baseline, views) pair is encoded once and the bytes reused
+    # for every client that shares it: key -> {"payload", "tcp", "udp"}.
+    # With interest filtering most keys are per client, so the encoder also
+    # packs each player's record only once per baseline.
+    encoded = {}
+    removed = []
+    for pid, info in targets:
+        udp_addr = info["udp_addr"]
+        acked = info["acked"]
+        # TCP delivers everything we send; over UDP keep resending until acked
+        if info["sent"] == snapshot_seq and (info["sent_tcp"] or acked == snapshot_seq):
+            continue
+        base_seq = acked if acked in snapshot_history else None
+        views = info["views"]  # seq -> ids this client was sent at that seq
+        if grid is None:
+            view = None
+        elif snapshot_seq not in views:
+            view = interest.relevant_players(grid, state["players"], always_relevant, pid,
+                                             views.get(info["sent"]), interest.INTEREST_RADIUS)
+            views[snapshot_seq] = view
+            views.pop(snapshot_seq - snapshot.HISTORY_SIZE, None)
+        else:
+            view = views[snapshot_seq]
+        if grid is not None and base_seq not in views:
+            base_seq = None  # Can't diff without knowing what the client saw
+        base_view = views.get(base_seq)
+        key = (base_seq, view, base_view)
+        try:
+            if key not in encoded:
+                encoded[key] = {"payload": encoder.encode(base_seq, view, base_view)}
+            frames = encoded[key]
+            # Only datagrams that fit in one packet go over UDP, the rest over TCP
+            via_udp = udp_addr is not None and \
+                len(frames["payload"]) + protocol.DGRAM_HEADER.size <= protocol.MAX_DATAGRAM
+            if via_udp:
+                if "udp" not in frames:
+                    frames["udp"] = protocol.encode_datagram(DGRAM_SNAPSHOT, snapshot_seq, frames["payload"])
+                udp_sock.sendto(frames["udp"], udp_addr)
+                info["udp_out"] += len(frames["udp"])
+                metrics.MESSAGES.inc("out", "snapshot_udp")
+            else:
+                if "tcp" not in frames:
+                    frames["tcp"] = protocol.encode_frame(MSG_SNAPSHOT, frames["payload"])
+                info["out"].send(frames["tcp"], droppable=True)
+                metrics.MESSAGES.inc("out", "snapshot_tcp")
+            info["sent_tcp"] = not via_udp
+            info["sent"] = snapshot_seq
+        except:
+            removed.append(pid)
+    if removed:
+        with LOCK:
+            for r in removed:
+                remove_player(r)
+
+def player_meta(player_id):
+    """Static fields of a player, sent on join and when they change. Caller holds LOCK."""
+    pdata = players[player_id]
+    return {"name": pdata["name"], "color": pdata["color"]}
+
+def send_to_all(msg):
+    """Queue a reliable JSON message for every joined client. Caller holds LOCK."""
+    frame = protocol.encode_json(msg)
+    for info in clients.values():
+        info["out"].send(frame)
+    metrics.MESSAGES.inc("out", msg["type"], amount=len(clients))
+
+def set_player_meta(player_id, **fields):
+    """Change a player's name/color and tell everyone."""
+    with LOCK:
+        if player_id not in players:
+            return
+        players[player_id] = {**players[player_id], **fields}
+        if "name" in fields:
+            leaderboard.rename(player_id, fields["name"])
+        send_to_all({"type": "player_meta", "players": {player_id: player_meta(player_id)}})
+
+def set_score(player_id, score):
+    """Set a player's score; the leaderboard goes out on the next tick if it changed."""
+    with LOCK:
+        if player_id not in players:
+            return
+        scores[player_id] = score
+        leaderboard.set_score(player_id, score)
+
+def client_queue_depths():
+    """Outbound queue depth per client: {player_id: {"messages", "bytes", "dropped"}}."""
+    with LOCK:
+        outs = {pid: info["out"] for pid, info in clients.items()}
+    return {pid: out.depth() for pid, out in outs.items()}
+
+def remove_player(player_id):
+    """Forget a player's state. Caller holds LOCK."""
+    info = clients.pop(player_id, None)
+    if info and info["udp_addr"] in udp_clients:
+        del udp_clients[info["udp_addr"]]
+    if player_id in players:
+        del players[player_id]
+        send_to_all({"type": "player_left", "id": player_id})
+    if player_id in scores: del scores[player_id]
+    leaderboard.remove(player_id)
+
+def apply_position(player_id, d):
+    """Write a position update into `players`. Caller holds LOCK."""
+    old = players.get(player_id)
+    if old is not None:
+        x = float(d.get("x", old["x"]))
+        y = float(d.get("y", old["y"]))
+        z = float(d.get("z", old["z"]))
+        if not (math.isfinite(x) and math.isfinite(y) and math.isfinite(z)):
+            return
+        # Replace rather than mutate: snapshots share the old dict outside LOCK
+        new = {**old, "x": x, "y": y, "z": z}
+        # Velocity and facing are optional; a client that stops reporting
+        # velocity reads as standing still rather than drifting
+        try:
+            if "vx" in d:
+                velocity = [float(d[axis]) for axis in snapshot.VELOCITY_FIELDS]
+                if all(math.isfinite(v) for v in velocity):
+                    new.update(zip(snapshot.VELOCITY_FIELDS, velocity))
+            elif "vx" in old:
+                new.update(vx=0.0, vy=0.0, vz=0.0)
+            if "yaw" in d and math.isfinite(float(d["yaw"])):
+                new["yaw"] = float(d["yaw"])
+        except (KeyError, TypeError, ValueError):
+            pass
+        players[player_id] = new
+
+def apply_ack(player_id, seq):
+    """Record that a client holds snapshot `seq`. Caller holds LOCK."""
+    info = clients.get(player_id)
+    # JSON acks can carry anything; 1.0 or True would match a history key
+    if type(seq) is not int:
+        return
+    if info and seq in snapshot_history and protocol.seq_newer(seq, info["acked"]):
+        info["acked"] = seq
+
+def status_message():
+    """Summary for server browsers. Only reads counters; never takes LOCK."""
+    return {"players": len(players), "map": map_filename, "sha256": map_sha256,
+            "tick_rate": tick_stats["rate"], "tick_ms": round(tick_stats["avg_ms"], 3),
+            "overruns": tick_stats["overruns"], "uptime": int(time.time() - started_at)}
+
+def record_tick(started, duration):
+    """Record one tick that started at `started` (perf_counter) and broadcast for `duration`."""
+    tick_stats["avg_ms"] += (duration * 1000.0 - tick_stats["avg_ms"]) * 0.05
+    if tick_stats["last_start"] is not None:
+        metrics.TICK_INTERVAL.observe(started - tick_stats["last_start"])
+    tick_stats["last_start"] = started
+    metrics.BROADCAST.observe(duration)
+
+def metrics_lines():
+    """Player count and per-client traffic/queue lines for the metrics endpoint."""
+    with LOCK:
+        rows = [(pid, info["out"], info["tcp_in"], info["udp_in"], info["udp_out"])
+                for pid, info in clients.items()]
+        player_count = len(players)
+    depths = client_queue_depths()
+    lines = ["# HELP gtamini_players Players currently joined",
+             "# TYPE gtamini_players gauge", f"gtamini_players {player_count}"]
+    traffic = ["# HELP gtamini_client_bytes_total Bytes exchanged with each client",
+               "# TYPE gtamini_client_bytes_total counter"]
+    queued = ["# HELP gtamini_client_queue_bytes Unsent bytes queued for each client",
+              "# TYPE gtamini_client_queue_bytes gauge"]
+    messages = ["# HELP gtamini_client_queue_messages Unsent frames queued for each client",
+                "# TYPE gtamini_client_queue_messages gauge"]
+    dropped = ["# HELP gtamini_client_snapshots_dropped_total Snapshots dropped for lagging clients",
+               "# TYPE gtamini_client_snapshots_dropped_total counter"]
+    for pid, out, tcp_in, udp_in, udp_out in rows:
+        for direction, transport, value in (("in", "tcp", tcp_in), ("in", "udp", udp_in),
+                                            ("out", "tcp", out.bytes_sent), ("out", "udp", udp_out)):
+            traffic.append(f'gtamini_client_bytes_total{{player="{pid}",direction="{direction}",'
+                           f'transport="{transport}"}} {value}')
+        depth = depths.get(pid)
+        if depth is None:
+            continue  # Left between the two reads
+        queued.append(f'gtamini_client_queue_bytes{{player="{pid}"}} {depth["bytes"]}')
+        messages.append(f'gtamini_client_queue_messages{{player="{pid}"}} {depth["messages"]}')
+        dropped.append(f'gtamini_client_snapshots_dropped_total{{player="{pid}"}} {depth["dropped"]}')
+    return lines + traffic + queued + messages + dropped
+
+def handle_datagram(data, addr):
+    """Handle one UDP datagram from a client."""
+    dgram_type, seq, payload = protocol.decode_datagram(data)
+    metrics.MESSAGES.inc("in", DGRAM_NAMES.get(dgram_type, "other"))
+    if dgram_type == DGRAM_PING:
+        udp_sock.sendto(data, addr)
+        return
+    if dgram_type == DGRAM_STATUS:
+        # Answered from counters alone: probing a server costs no game state
+        status = json.dumps(status_message(), separators=(",", ":")).encode()
+        udp_sock.sendto(protocol.encode_datagram(DGRAM_STATUS, seq, status), addr)
+        return
+    if dgram_type == DGRAM_HELLO:
+        hello = json.loads(payload.decode())
+        pid = str(hello.get("id"))
+        with LOCK:
+            info = clients.get(pid)
+            if not info or hello.get("token") != info["token"]:
+                return
+            if info["udp_addr"] != addr:
+                udp_clients.pop(info["udp_addr"], None)
+                info["udp_addr"] = addr
+                info["udp_seq"] = None
+                udp_clients[addr] = pid
+        # Echo so the client knows the channel works
+        udp_sock.sendto(data, addr)
+        return
+
+    with LOCK:
+        pid = udp_clients.get(addr)
+        if pid is None:
+            return
+        clients[pid]["udp_in"] += len(data)
+        if dgram_type == DGRAM_POSITION:
+            info = clients[pid]
+            # Drop reordered/duplicate position packets
+            if not protocol.seq_newer(seq, info["udp_seq"]):
+                return
+            info["udp_seq"] = seq
+            if len(payload) >= protocol.MOTION_PAYLOAD.size:
+                x, y, z, vx, vy, vz, yaw = protocol.MOTION_PAYLOAD.unpack_from(payload)
+                apply_position(pid, {"x": x, "y": y, "z": z, "vx": vx, "vy": vy, "vz": vz, "yaw": yaw})
+            else:
+                x, y, z = protocol.POSITION_PAYLOAD.unpack_from(payload)
+                apply_position(pid, {"x": x, "y": y, "z": z})
+        elif dgram_type == DGRAM_ACK:
+            apply_ack(pid, seq)
+
+def udp_loop():
+    while True:
+        try:
+            data, addr = udp_sock.recvfrom(65535)
+        except OSError:
+            continue
+        try:
+            handle_datagram(data, addr)
+        except Exception as e:
+            print(f"Bad datagram from {addr}: {e}")
+
+def beacon_loop(port):
+    """Announce the server on the LAN every BEACON_INTERVAL seconds."""
+    sock = discovery.make_beacon_socket()
+    targets = discovery.beacon_targets(get_local_ip())
+    seq = 0
+    while True:
+        discovery.send_beacon(sock, seq, port, status_message(), targets)
+        seq += 1
+        time.sleep(discovery.BEACON_INTERVAL)
+
+def run_tick():
+    """One broadcast. Errors are logged, not raised, so one bad tick can't freeze the room."""
+    started = time.perf_counter()
+    try:
+        broadcast_players()
+    except Exception as e:
+        print(f"Tick failed: {e}")
+        traceback.print_exc()
+    record_tick(started, time.perf_counter() - started)
+
+def tick_loop(tick_rate=TICK_RATE):
+    """Broadcast one snapshot per tick; incoming packets only update `players`."""
+    interval = 1.0 / tick_rate
+    tick_stats["rate"] = tick_rate
+    next_tick = time.perf_counter()
+    while True:
+        if clients:
+            run_tick()
+        next_tick += interval
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # Running behind: skip missed ticks instead of bursting to catch up
+            tick_stats["overruns"] += 1
+            next_tick = time.perf_counter()
+
+def file_sha256(path):
+    """SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 def load_map_file():
-    """Load map file from assets/map/mesto directory. Returns (data, filename) or (None, None)"""
-    global map_data, map_filename
+    """Find the map file in assets/map/mesto and hash it. Returns (path, filename) or (None, None)"""
+    global map_path, map_filename, map_size, map_sha256, map_manifest
     # Prefer model.fbx first, then Untitled.glb
     map_paths = [
         'assets/map/mesto/model.fbx',
@@ -73,11 +418,14 @@ def load_map_file():
     for path in map_paths:
         if os.path.exists(path):
             try:
-                with open(path, 'rb') as f:
-                    map_data = base64.b64encode(f.read()).decode('utf-8')
-                    map_filename = os.path.basename(path)
-                    print(f"Loaded map file: {path} ({len(map_data)} bytes encoded)")
-                    return map_data, map_filename
+                map_size = os.path.getsize(path)
+                map_sha256 = file_sha256(path)
+                map_manifest = map_transfer.make_manifest(path)
+                map_path = path
+                map_filename = os.path.basename(path)
+                print(f"Loaded map file: {path} ({map_size} bytes, sha256 {map_sha256[:12]})")
+                prepare_compressed_map()
+                return map_path, map_filename
             except Exception as e:
                 print(f"Error loading map {path}: {e}")
                 continue
@@ -85,102 +433,238 @@ def load_map_file():
     print("WARNING: No map file found. Clients will need map files locally.")
     return None, None
 
-def send_map_to_client(conn):
-    """Send map file data to client"""
-    global map_data, map_filename
-    if map_data and map_filename:
-        # Send map info (filename and data size)
-        info_msg = json.dumps({
-            "type": "map_info",
-            "filename": map_filename,
-            "size": len(map_data)
-        }).encode()
-        conn.sendall(info_msg)
-        
-        # Wait for client ready signal
-        try:
-            conn.recv(4)  # Client sends "OK"
-        except:
-            pass
-        
-        # Send base64 data in chunks
-        chunk_size = 8192
-        data_bytes = map_data.encode('utf-8')
-        for i in range(0, len(data_bytes), chunk_size):
-            chunk = data_bytes[i:i+chunk_size]
-            conn.sendall(chunk)
-        
-        # Send completion message
-        conn.sendall(json.dumps({"type": "map_complete"}).encode())
-        print(f"Sent map file {map_filename} to client ({len(data_bytes)} bytes)")
+def prepare_compressed_map():
+    """
+    Compress the map once, next to the source file. A small JSON sidecar
+    records the source size/mtime/hash and the settings used, so restarts
+    reuse the compressed file unless the map changed. The compressed file
+    is only offered if it is smaller than the map.
+    """
+    map_encoded.clear()
+    encoding = map_transfer.COMPRESSION
+    if encoding not in map_transfer.ENCODINGS:
+        return
+    packed_path = map_path + map_transfer.EXTENSIONS[encoding]
+    sidecar_path = packed_path + ".json"
+    stat = os.stat(map_path)
+    source = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": map_sha256,
+              "encoding": encoding, "level": map_transfer.COMPRESS_LEVEL}
+
+    try:
+        with open(sidecar_path) as f:
+            sidecar = json.load(f)
+        manifest = sidecar["manifest"]
+        if sidecar.get("source") == source and os.path.getsize(packed_path) == manifest["size"]:
+            if manifest["size"] < map_size:
+                map_encoded[encoding] = (packed_path, manifest)
+                print(f"Using compressed map {packed_path} ({manifest['size']} bytes)")
+            return
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    try:
+        started = time.perf_counter()
+        size = map_transfer.compress_file(map_path, packed_path, encoding,
+                                          map_transfer.COMPRESS_LEVEL)
+        manifest = map_transfer.make_manifest(packed_path)
+        with open(sidecar_path, 'w') as f:
+            json.dump({"source": source, "manifest": manifest}, f)
+    except OSError as e:
+        print(f"Could not write compressed map, sending it uncompressed: {e}")
+        return
+    print(f"Compressed map with {encoding} in {time.perf_counter() - started:.2f}s "
+          f"({map_size} -> {size} bytes)")
+    if size < map_size:
+        map_encoded[encoding] = (packed_path, manifest)
+
+def map_info_message():
+    """Header for the map transfer: what follows and how to verify it."""
+    if not map_path:
+        return {"type": "map_info", "filename": None, "size": 0}
+    return {"type": "map_info", "filename": map_filename, "size": map_size, "sha256": map_sha256,
+            "manifest": map_manifest,
+            "encodings": {enc: manifest for enc, (_, manifest) in map_encoded.items()}}
+
+def map_stream(ready):
+    """
+    (path, encoding, offset) to send for a map_ready message: the encoding
+    the client asked for if we have it, from the offset it resumes at.
+    """
+    encoding = ready.get("encoding")
+    if encoding in map_encoded:
+        path, manifest = map_encoded[encoding]
     else:
-        # Send empty map message
-        conn.sendall(json.dumps({"type": "map_info", "filename": None, "size": 0}).encode())
+        path, manifest, encoding = map_path, map_manifest, None
+    offset = ready.get("offset", 0)
+    if not isinstance(offset, int) or not 0 <= offset <= manifest["size"]:
+        offset = 0
+    return path, encoding, offset
 
-def handle_client(conn, addr):
+def send_map_to_client(conn, reader):
+    """Stream the map file to the client straight from disk"""
+    protocol.send_json(conn, map_info_message())
+    if not map_path:
+        return
+
+    # Wait for client ready signal
+    ready = reader.read_json()
+    if not ready or ready.get("type") != "map_ready":
+        return
+    if ready.get("have"):
+        print(f"Client already has map {map_filename} cached")
+        return
+
+    # Raw bytes, no framing: sendfile() copies from the page cache to the socket
+    path, encoding, offset = map_stream(ready)
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        sent = conn.sendfile(f, offset=offset)
+    metrics.record_map_transfer(sent, time.perf_counter() - started, encoding)
+
+    # Send completion message
+    protocol.send_json(conn, {"type": "map_complete"})
+    print(f"Sent map file {map_filename} to client ({sent} bytes from offset {offset}, "
+          f"{encoding or 'uncompressed'})")
+
+def new_player_id():
+    """
+    A free player id, or None if all MAX_PLAYER_IDS are taken. Ids are handed
+    out round-robin and reused once their connection ends (see
+    release_player_id), so they always fit the u16 snapshot field.
+    """
     global next_id
+    with LOCK:
+        for _ in range(MAX_PLAYER_IDS):
+            candidate = next_id
+            next_id = (next_id + 1) % MAX_PLAYER_IDS
+            if str(candidate) not in ids_in_use:
+                ids_in_use.add(str(candidate))
+                return str(candidate)
+    return None
+
+def release_player_id(player_id):
+    """Free an id from new_player_id. Only once its connection is done, so a
+    late message from the old connection can't reach a new player. Caller holds LOCK."""
+    ids_in_use.discard(player_id)
+
+def handshake_message(player_id, token):
+    """First message to a new connection: its id, plus the UDP channel to opt into."""
+    return {"id": player_id, "udp_port": udp_port, "token": token, "world": snapshot.world_bounds()}
+
+def register_player(player_id, init, token, out, addr):
+    """
+    Add a player once its handshake is done. `out` is the client's outbound
+    sender (see outbound.py); all later TCP frames go through it.
+    """
+    name = init.get("name", f"Player{player_id}")
+    requested_color = init.get("color", "")
+
+    with LOCK:
+        # Only join the tick broadcast once the handshake is done, so
+        # snapshots never interleave with the map transfer
+        clients[player_id] = {"out": out, "addr": addr, "acked": None, "sent": None, "sent_tcp": False,
+                              "views": {}, "token": token, "udp_addr": None, "udp_seq": None,
+                              "tcp_in": 0, "udp_in": 0, "udp_out": 0}
+        # Use requested color if valid, otherwise assign from pool
+        if requested_color in COLOR_POOL:
+            color = requested_color
+        else:
+            color = COLOR_POOL[int(player_id) % len(COLOR_POOL)]
+        players[player_id] = {"x":0,"y":0,"z":0,"name":name,"color":color}
+        scores[player_id] = 0
+        leaderboard.add(player_id, name, 0)
+
+        # Newcomer learns everyone's name/color once; everyone else learns theirs
+        out.send(protocol.encode_json({"type": "player_meta",
+                                       "players": {pid: player_meta(pid) for pid in players}}))
+        others = {"type": "player_meta", "players": {player_id: player_meta(player_id)}}
+        frame = protocol.encode_json(others)
+        for pid, info in clients.items():
+            if pid != player_id:
+                info["out"].send(frame)
+
+CLIENT_MESSAGE_TYPES = ("position", "ack", "resync")
+
+def handle_message(player_id, d, nbytes=0):
+    """Handle a JSON message (`nbytes` long on the wire) from a joined client."""
+    msg_type = d.get("type")
+    # Only known types become metric labels, so clients can't add series
+    metrics.MESSAGES.inc("in", msg_type if msg_type in CLIENT_MESSAGE_TYPES else "other")
+    with LOCK:
+        if player_id in clients:
+            clients[player_id]["tcp_in"] += nbytes
+        if msg_type == "position":
+            # Handle position update
+            apply_position(player_id, d)
+        elif msg_type == "ack":
+            # Client now holds this snapshot; use it as its delta baseline
+            apply_ack(player_id, d.get("seq"))
+        elif msg_type == "resync":
+            # Client lost its baseline: send a full snapshot next tick
+            if player_id in clients:
+                clients[player_id]["acked"] = None
+                clients[player_id]["sent"] = None
+
+def handle_client(conn, addr):
+    player_id = None
+    out = None
     try:
-        with LOCK:
-            player_id = str(next_id)
-            next_id += 1
-            clients[player_id] = {"conn": conn, "addr": addr}
-        conn.sendall(json.dumps({"id": player_id}).encode())
+        reader = FrameReader(conn)
+        player_id = new_player_id()
+        if player_id is None:
+            print(f"Server full, refusing {addr}")
+            return
+        token = secrets.token_hex(8)
+        # Advertise the UDP channel; the client opts in with a DGRAM_HELLO
+        protocol.send_json(conn, handshake_message(player_id, token))
         
         # Send map file to client
-        send_map_to_client(conn)
-
-        data = conn.recv(4096)
-        init = json.loads(data.decode())
-        name = init.get("name", f"Player{player_id}")
-        requested_color = init.get("color", "")
-
-        with LOCK:
-            # Use requested color if valid, otherwise assign from pool
-            if requested_color in COLOR_POOL:
-                color = requested_color
-            else:
-                color = COLOR_POOL[int(player_id) % len(COLOR_POOL)]
-            players[player_id] = {"x":0,"y":0,"z":0,"name":name,"color":color}
-            scores[player_id] = 0
+        send_map_to_client(conn, reader)
 
-        broadcast_players()
+        init = reader.read_json()
+        if init is None:
+            return
+        out = outbound.ThreadedSender(conn)
+        register_player(player_id, init, token, out, addr)
 
         while True:
-            data = conn.recv(4096)
-            if not data:
+            msg_type, payload = reader.read()
+            if msg_type is None:
                 break
-            d = json.loads(data.decode())
-            
-            with LOCK:
-                if d.get("type") == "position":
-                    # Handle position update
-                    if player_id in players:
-                        players[player_id].update({
-                            "x": float(d.get("x", players[player_id]["x"])),
-                            "y": float(d.get("y", players[player_id]["y"])),
-                            "z": float(d.get("z", players[player_id]["z"]))
-                        })
-            broadcast_players()
+            if msg_type == MSG_JSON:
+                handle_message(player_id, protocol.decode_json(payload),
+                               protocol.HEADER.size + len(payload))
 
     except: pass
     finally:
+        if out:
+            out.close()
+        try: conn.close()
+        except: pass
         with LOCK:
-            if player_id in clients:
-                try: clients[player_id]["conn"].close()
-                except: pass
-                del clients[player_id]
-            if player_id in players: del players[player_id]
-            if player_id in scores: del scores[player_id]
-        broadcast_players()
+            remove_player(player_id)
+            release_player_id(player_id)
 
-def start_server(port=9999):
+def start_server(port=9999, tick_rate=TICK_RATE):
+    global udp_sock, udp_port, started_at
+    started_at = time.time()
     load_map_file()  # Load map on server start
+
+    udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp_sock.bind(("0.0.0.0", port))
+    udp_port = port
+    threading.Thread(target=udp_loop, daemon=True).start()
+    threading.Thread(target=tick_loop, args=(tick_rate,), daemon=True).start()
+    if discovery.BEACON_INTERVAL > 0:
+        threading.Thread(target=beacon_loop, args=(port,), daemon=True).start()
+    if metrics.METRICS_PORT:
+        metrics.serve(metrics.METRICS_PORT, metrics_lines)
     
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.bind(("0.0.0.0", port))
     server.listen()
     local_ip = get_local_ip()
-    print(f"SERVER RUNNING ON: {local_ip}:{port}")
+    print(f"SERVER RUNNING ON: {local_ip}:{port} ({tick_rate} Hz tick)")
     print("Players on the same LAN should use this IP to connect.")
 
     try:
@@ -192,5 +676,46 @@ def start_server(port=9999):
     finally:
         server.close()
 
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="GTA mini game server")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE,
+                        help="snapshots broadcast per second")
+    parser.add_argument("--queue-bytes", type=int, default=outbound.QUEUE_MAX_BYTES,
+                        help="max unsent bytes queued per client")
+    parser.add_argument("--queue-policy", choices=[outbound.DROP_OLDEST, outbound.DISCONNECT],
+                        default=outbound.QUEUE_POLICY,
+                        help="what to do when a client exceeds --queue-bytes")
+    parser.add_argument("--interest-radius", type=float, default=interest.INTEREST_RADIUS,
+                        help="only send players within this distance (0 = everyone)")
+    parser.add_argument("--world-bounds", type=float, nargs=2, metavar=("MIN", "MAX"),
+                        default=(snapshot.WORLD_MIN, snapshot.WORLD_MAX),
+                        help="coordinate range snapshots can carry on every axis; "
+                             "positions outside it are clamped")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="run the asyncio server core instead of a thread per client")
+    parser.add_argument("--map-compression", choices=list(map_transfer.ENCODINGS) + ["none"],
+                        default=map_transfer.COMPRESSION, help="how the map is compressed for transfer")
+    parser.add_argument("--map-level", type=int, default=map_transfer.COMPRESS_LEVEL,
+                        help="compression level for --map-compression (0-9)")
+    parser.add_argument("--beacon-interval", type=float, default=discovery.BEACON_INTERVAL,
+                        help="seconds between LAN discovery beacons (0 = off)")
+    parser.add_argument("--metrics-port", type=int, default=metrics.METRICS_PORT,
+                        help="serve Prometheus metrics on 127.0.0.1:PORT (0 = off)")
+    return parser
+
 if __name__ == "__main__":
-    start_server(9999)
+    args = build_arg_parser().parse_args()
+    outbound.QUEUE_MAX_BYTES = args.queue_bytes
+    outbound.QUEUE_POLICY = args.queue_policy
+    interest.INTEREST_RADIUS = args.interest_radius
+    snapshot.set_world_bounds(*args.world_bounds)
+    map_transfer.COMPRESSION = args.map_compression
+    map_transfer.COMPRESS_LEVEL = args.map_level
+    discovery.BEACON_INTERVAL = args.beacon_interval
+    metrics.METRICS_PORT = args.metrics_port
+    if args.use_async:
+        import server_async
+        server_async.start_server(args.port, tick_rate=args.tick_rate)
+    else:
+        start_server(args.port, tick_rate=args.tick_rate)
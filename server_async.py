@@ -0,0 +1,197 @@
+import asyncio
+import secrets
+import time
+
+import protocol
+import server
+import outbound
+import interest
+import snapshot
+import map_transfer
+import discovery
+import metrics
+from protocol import MSG_JSON
+
+# asyncio server core: a single event loop accepts connections, reads
+# frames, runs the tick and writes to every client without blocking. Game
+# state still lives in `server` (players, scores, clients) and is changed
+# through the same functions the threaded server uses, so both modes speak
+# the exact same protocol. Only the loop thread touches that state here, so
+# server.LOCK is never contended.
+
+async def read_frame(reader):
+    """Return the next (msg_type, payload) from a StreamReader."""
+    header = await reader.readexactly(protocol.HEADER.size)
+    length, msg_type = protocol.HEADER.unpack(header)
+    if length > protocol.MAX_PAYLOAD:
+        raise protocol.ProtocolError(f"Frame too large: {length} bytes")
+    payload = await reader.readexactly(length)
+    return msg_type, payload
+
+
+async def read_json(reader):
+    """Return the next JSON message, skipping other frame types."""
+    while True:
+        msg_type, payload = await read_frame(reader)
+        if msg_type == MSG_JSON:
+            return protocol.decode_json(payload)
+
+
+async def send_map_to_client(reader, writer):
+    """Stream the map file to the client without blocking the loop"""
+    writer.write(protocol.encode_json(server.map_info_message()))
+    if not server.map_path:
+        return
+
+    # Wait for client ready signal
+    ready = await read_json(reader)
+    if ready.get("type") != "map_ready":
+        return
+    if ready.get("have"):
+        print(f"Client already has map {server.map_filename} cached")
+        return
+
+    await writer.drain()
+    loop = asyncio.get_running_loop()
+    path, encoding, offset = server.map_stream(ready)
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        # Uses os.sendfile where the platform supports it
+        sent = await loop.sendfile(writer.transport, f, offset=offset)
+    metrics.record_map_transfer(sent, time.perf_counter() - started, encoding)
+
+    writer.write(protocol.encode_json({"type": "map_complete"}))
+    print(f"Sent map file {server.map_filename} to client ({sent} bytes from offset {offset}, "
+          f"{encoding or 'uncompressed'})")
+
+
+async def handle_client(reader, writer):
+    addr = writer.get_extra_info("peername")
+    player_id = server.new_player_id()
+    if player_id is None:
+        print(f"Server full, refusing {addr}")
+        writer.close()
+        return
+    out = None
+    try:
+        token = secrets.token_hex(8)
+        writer.write(protocol.encode_json(server.handshake_message(player_id, token)))
+
+        await send_map_to_client(reader, writer)
+
+        init = await read_json(reader)
+        out = outbound.AsyncSender(writer)
+        server.register_player(player_id, init, token, out, addr)
+
+        while True:
+            msg_type, payload = await read_frame(reader)
+            if msg_type == MSG_JSON:
+                server.handle_message(player_id, protocol.decode_json(payload),
+                                      protocol.HEADER.size + len(payload))
+    except (asyncio.IncompleteReadError, ConnectionError, protocol.ProtocolError):
+        pass
+    except Exception as e:
+        print(f"Client {player_id} error: {e}")
+    finally:
+        with server.LOCK:
+            server.remove_player(player_id)
+            server.release_player_id(player_id)
+        if out:
+            out.close()
+        writer.close()
+
+
+class UdpProtocol(asyncio.DatagramProtocol):
+    """Feeds datagrams on the game port into server.handle_datagram."""
+
+    def datagram_received(self, data, addr):
+        try:
+            server.handle_datagram(data, addr)
+        except Exception as e:
+            print(f"Bad datagram from {addr}: {e}")
+
+    def error_received(self, exc):
+        # ICMP errors for a client that went away; nothing to do
+        pass
+
+
+async def tick_loop(tick_rate=server.TICK_RATE):
+    """Broadcast one snapshot per tick on the event loop."""
+    interval = 1.0 / tick_rate
+    server.tick_stats["rate"] = tick_rate
+    next_tick = time.perf_counter()
+    while True:
+        if server.clients:
+            server.run_tick()
+        next_tick += interval
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            # Running behind: skip missed ticks, but still yield to readers
+            server.tick_stats["overruns"] += 1
+            next_tick = time.perf_counter()
+            await asyncio.sleep(0)
+
+
+async def beacon_loop(port):
+    """Announce the server on the LAN every BEACON_INTERVAL seconds."""
+    sock = discovery.make_beacon_socket()
+    targets = discovery.beacon_targets(server.get_local_ip())
+    seq = 0
+    try:
+        while True:
+            discovery.send_beacon(sock, seq, port, server.status_message(), targets)
+            seq += 1
+            await asyncio.sleep(discovery.BEACON_INTERVAL)
+    finally:
+        sock.close()
+
+
+async def run_server(port=9999, tick_rate=server.TICK_RATE):
+    server.started_at = time.time()
+    server.load_map_file()  # Load map on server start
+    loop = asyncio.get_running_loop()
+
+    # Datagram transports have the same sendto() the threaded server uses
+    udp_transport, _ = await loop.create_datagram_endpoint(UdpProtocol, local_addr=("0.0.0.0", port))
+    server.udp_sock = udp_transport
+    server.udp_port = port
+
+    tcp_server = await asyncio.start_server(handle_client, "0.0.0.0", port)
+    local_ip = server.get_local_ip()
+    print(f"SERVER RUNNING ON: {local_ip}:{port} ({tick_rate} Hz tick, asyncio)")
+    print("Players on the same LAN should use this IP to connect.")
+
+    if metrics.METRICS_PORT:
+        metrics.serve(metrics.METRICS_PORT, server.metrics_lines)
+    tasks = [asyncio.create_task(tick_loop(tick_rate))]
+    if discovery.BEACON_INTERVAL > 0:
+        tasks.append(asyncio.create_task(beacon_loop(port)))
+    try:
+        async with tcp_server:
+            await tcp_server.serve_forever()
+    finally:
+        for task in tasks:
+            task.cancel()
+        udp_transport.close()
+
+
+def start_server(port=9999, tick_rate=server.TICK_RATE):
+    try:
+        asyncio.run(run_server(port, tick_rate))
+    except KeyboardInterrupt:
+        print("Server shutting down...")
+
+
+if __name__ == "__main__":
+    args = server.build_arg_parser().parse_args()
+    outbound.QUEUE_MAX_BYTES = args.queue_bytes
+    outbound.QUEUE_POLICY = args.queue_policy
+    interest.INTEREST_RADIUS = args.interest_radius
+    snapshot.set_world_bounds(*args.world_bounds)
+    map_transfer.COMPRESSION = args.map_compression
+    map_transfer.COMPRESS_LEVEL = args.map_level
+    discovery.BEACON_INTERVAL = args.beacon_interval
+    metrics.METRICS_PORT = args.metrics_port
+    start_server(args.port, tick_rate=args.tick_rate)
@@ -1,52 +1,11 @@
 from ursina import *
-import socket, threading, json
+import time
+import discovery
+import lan_scan
 
-PORT = 9999
-SCAN_TIMEOUT = 0.25
-
-# ----------------------------
-# LAN SCAN
-# ----------------------------
-def ping_server(ip):
-    try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(SCAN_TIMEOUT)
-        s.connect((ip, PORT))
-        data = s.recv(4096)
-        js = json.loads(data.decode())
-        if "id" in js:
-            return True
-        return False
-    except:
-        return False
-    finally:
-        try: s.close()
-        except: pass
-
-def scan_lan(extra_subnets=None):
-    local_ip = socket.gethostbyname(socket.gethostname())
-    primary_subnet = ".".join(local_ip.split(".")[:3])
-    subnets = {primary_subnet}
-    if extra_subnets:
-        subnets.update(extra_subnets)
-    found = []
-    threads = []
-
-    def worker(ip):
-        if ping_server(ip):
-            found.append(ip)
-
-    for subnet in subnets:
-        for i in range(1, 255):
-            ip = f"{subnet}.{i}"
-            t = threading.Thread(target=worker, args=(ip,))
-            t.start()
-            threads.append(t)
-
-    for t in threads:
-        t.join()
-
-    return found
+PORT = 9999  # Game port when a server doesn't say otherwise
+SWEEP_DELAY = 1.5  # Probe every address only if no beacon arrived by then
+PING_INTERVAL = 3.0  # Seconds between latency refreshes while the browser is open
 
 # ----------------------------
 # SERVER BROWSER UI
@@ -56,8 +15,13 @@ class ServerBrowser(Entity):
         super().__init__(**kwargs)
         self.callback = callback
         self.buttons = []
-        self._scanning = False
+        self.scanner = None  # lan_scan.LanScanner while a sweep runs
         self._ui_elems = []
+        self._closed = False
+        self.servers = {}   # (ip, port) -> (status, expires_at); None = found by a sweep, kept until refresh
+        self._stale = set() # Sweep results from before a refresh, dropped unless found again
+        self.rtts = {}      # (ip, port) -> median round-trip time in ms (None = no reply)
+        self._shown = None  # What the buttons currently show, to skip needless redraws
 
         # ------------------------------
         # Semi-transparent background (made bigger)
@@ -116,21 +80,106 @@ class ServerBrowser(Entity):
         self.connect_btn.on_click = self._manual_connect
         self._ui_elems.append(self.connect_btn)
 
-        threading.Thread(target=self._scan, daemon=True).start()
+        # Beacons fill the list as they arrive; the sweep is only a fallback
+        try:
+            self.listener = discovery.BeaconListener(self._on_beacon)
+        except OSError as e:
+            print(f"Beacon listener unavailable ({e}), scanning instead")
+            self.listener = None
+        # Servers we joined before answer first; the full sweep waits for beacons
+        self._scan(ranges=[])
+        invoke(self._fallback_scan, delay=SWEEP_DELAY if self.listener else 0)
+        invoke(self._ping_all, delay=PING_INTERVAL)
+
+    def update(self):
+        # Drop servers whose beacons stopped
+        now = time.time()
+        expired = [addr for addr, (_, expires) in self.servers.items() if expires and expires < now]
+        if expired:
+            for addr in expired:
+                del self.servers[addr]
+            self._refresh_list()
+
+    def _on_beacon(self, ip, status):
+        # Listener thread: hand over to the main thread for UI work
+        invoke(lambda: self._add_server(ip, status, time.time() + discovery.BEACON_TIMEOUT))
+
+    def _add_server(self, ip, status, expires):
+        if self._closed:
+            return
+        # Beacons and sweeps both report the game port in status["port"]
+        port = status.get("port")
+        addr = (ip, port if isinstance(port, int) and 0 < port < 65536 else PORT)
+        if addr not in self.servers:
+            self._ping([addr])
+        self.servers[addr] = (status, expires)
+        self._refresh_list()
+
+    def _ping(self, addrs):
+        lan_scan.measure_rtts(addrs, lambda addr, rtt: invoke(lambda: self._set_rtt(addr, rtt)))
+
+    def _ping_all(self):
+        if self._closed:
+            return
+        if self.servers:
+            self._ping(list(self.servers))
+        invoke(self._ping_all, delay=PING_INTERVAL)
+
+    def _set_rtt(self, addr, rtt):
+        if self._closed or addr not in self.servers:
+            return
+        self.rtts[addr] = rtt
+        self._refresh_list()
+
+    def _refresh_list(self):
+        # Fastest first; servers not measured yet go last
+        servers = sorted(
+            ((addr, status, self.rtts.get(addr)) for addr, (status, _) in self.servers.items()),
+            key=lambda entry: (entry[2] is None, entry[2] or 0.0, entry[0]))
+        shown = [(addr, status.get("players"), None if rtt is None else round(rtt))
+                 for addr, status, rtt in servers]
+        if shown == self._shown:
+            return
+        self._shown = shown
+        self._safe_display(servers)
+
+    def _fallback_scan(self):
+        if not self.servers and not self._closed:
+            self._scan()
 
     # Scan LAN servers
-    def _scan(self):
-        if self._scanning:
+    def _scan(self, ranges=None):
+        """Probe recent servers, then `ranges` (default: local /24 and hotspot subnet)."""
+        if self.scanner or self._closed:
             return
-        self._scanning = True
-        try:
-            # Try primary subnet and a common Windows hotspot subnet (192.168.137.x)
-            servers = scan_lan(extra_subnets={"192.168.137"})
-            # Ensure UI updates occur on main thread to avoid Panda3D NodePath asserts
-            from ursina import invoke
-            invoke(lambda: self._safe_display(servers))
-        finally:
-            self._scanning = False
+        ranges = lan_scan.local_ranges() if ranges is None else ranges
+        targets = lan_scan.iter_targets(ranges, first=lan_scan.load_recent())
+        # Callbacks come from the scanner thread; UI work must happen on the
+        # main thread to avoid Panda3D NodePath asserts
+        self.scanner = lan_scan.LanScanner(
+            targets,
+            on_found=lambda ip, status: invoke(lambda: self._add_scanned(ip, status)),
+            on_done=lambda: invoke(lambda: self._scan_done(sweep=bool(ranges))))
+
+    def _add_scanned(self, ip, status):
+        if self._closed:
+            return
+        addr = (ip, status["port"])
+        self._stale.discard(addr)
+        # Keep the beacon expiry if the server also sends beacons
+        expires = self.servers.get(addr, (None, None))[1]
+        self._add_server(ip, status, expires)
+
+    def _scan_done(self, sweep):
+        self.scanner = None
+        if self._closed or not sweep:
+            return
+        for addr in self._stale:
+            if addr in self.servers and self.servers[addr][1] is None:
+                del self.servers[addr]
+        self._stale.clear()
+        self._shown = None  # Always redraw so "not found" shows after a sweep
+        self._refresh_list()
 
     def _safe_display(self, servers):
         try:
@@ -155,17 +204,18 @@ class ServerBrowser(Entity):
         y_start = 0.15
         y_step = -0.25  # slightly increased spacing for bigger buttons
 
-        for i, ip in enumerate(servers):
+        for i, ((ip, port), status, rtt) in enumerate(servers):
+            latency = f"{rtt:.0f} ms" if rtt is not None else "? ms"
             try:
                 b = Button(
                     parent=camera.ui,  # <- make sure buttons are on top of all background UI
-                    text=f"{ip}:{PORT}",
+                    text=f"{ip}:{port}  ({status.get('players', 0)} players, {latency})",
                     scale=(0.9, 0.15),
                     y=y_start + y_step*i,
                     color=color.azure,
                     text_origin=(0,0)
                 )
-                b.on_click = (lambda ip=ip: self._choose(ip))
+                b.on_click = (lambda ip=ip, port=port: self._choose(ip, port))
                 self.buttons.append(b)
                 self._ui_elems.append(b)
             except Exception as e:
@@ -173,25 +223,34 @@ class ServerBrowser(Entity):
 
     # When a server is clicked
     # When a server is clicked
-    def _choose(self, ip):
+    def _choose(self, ip, port=PORT):
+        lan_scan.remember_server(ip, port)
         self._cleanup_ui()
         destroy(self)
 
     # Delay slightly to ensure UI is cleared before starting game
         from ursina import invoke
-        invoke(lambda: self.callback(ip), delay=0.05)
+        invoke(lambda: self.callback(ip, port), delay=0.05)
         
     # Refresh server list
     def refresh(self):
         self.title.text = "Hľadám servery..."
-        threading.Thread(target=self._scan, daemon=True).start()
+        # Known servers stay listed while the sweep re-checks them
+        self._stale = {addr for addr, (_, expires) in self.servers.items() if expires is None}
+        self._scan()
 
     def _manual_connect(self):
-        ip = self.ip_field.text.strip() if self.ip_field else ""
-        if ip:
-            self._choose(ip)
+        text = self.ip_field.text.strip() if self.ip_field else ""
+        if text:
+            # "ip" or "ip:port"
+            self._choose(*lan_scan.parse_address(text, PORT))
 
     def _cleanup_ui(self):
+        self._closed = True
+        if self.listener:
+            self.listener.stop()
+        if self.scanner:
+            self.scanner.cancel()
         # destroy all tracked ui entities
         for ent in self.buttons:
             try: destroy(ent)
@@ -207,7 +266,7 @@ class ServerBrowser(Entity):
 # ----------------------------
 def open_server_browser(callback):
     """
-    Opens a server browser UI and calls `callback(ip)` when a server is clicked.
+    Opens a server browser UI and calls `callback(ip, port)` when a server is clicked.
     """
     browser = ServerBrowser(callback)
     return browser
@@ -0,0 +1,299 @@
+import json
+import struct
+import time
+
+# --- SNAPSHOT DELTAS ---
+# A snapshot is {"players": {pid: {field: value}}}.
+# The server numbers snapshots with an increasing `seq` and, for each client,
+# only sends what changed since the last snapshot that client acknowledged
+# (its baseline). `base` is None for a full snapshot.
+#
+# With interest management a client only sees a subset of players (its
+# view). Players entering the view arrive as new entries with all fields;
+# players leaving it are listed in `removed`, same as a disconnect.
+
+HISTORY_SIZE = 64  # Snapshots kept for use as baselines (both sides)
+
+POSITION_FIELDS = ("x", "y", "z")
+VELOCITY_FIELDS = ("vx", "vy", "vz")  # Optional, when the client reports them
+FACING_FIELD = "yaw"                    # Optional, degrees
+
+# --- BINARY ENCODING ---
+# Snapshots go over the wire in a compact binary form:
+#   header: seq u32, base u32 (NO_BASE for full), server time f64,
+#           player count u16, removed count u16, flags u8 (reserved)
+#   player: id u16, flags u8, [x y z: u16 each], [meta: u16 length + JSON],
+#           [vx vy vz: i16 each], [yaw: u16]
+#   removed: id u16 each
+# Positions are fixed point relative to the world bounds, so a moving
+# player costs 9 bytes (17 with velocity and facing). The server picks the
+# bounds (--world-bounds) and tells clients in its handshake; positions
+# outside them are clamped to the edge, with a warning.
+POS_SCALE = 64                           # 1/64 unit (~1.6 cm) resolution
+WORLD_MIN = -512.0
+WORLD_MAX = WORLD_MIN + 65535 / POS_SCALE
+CLAMP_WARN_INTERVAL = 10.0               # Seconds between clamping warnings
+clamped = 0                              # Coordinates clamped so far
+_clamp_warned_at = None
+VEL_SCALE = 64                           # 1/64 unit/s; +/-512 units/s
+VEL_MAX = 32767 / VEL_SCALE
+YAW_SCALE = 65536 / 360.0
+NO_BASE = 0xFFFFFFFF
+
+SNAP_HEADER = struct.Struct("!IIdHHB")
+PLAYER_HEADER = struct.Struct("!HB")
+POSITION = struct.Struct("!HHH")
+VELOCITY = struct.Struct("!hhh")
+FACING = struct.Struct("!H")
+ID = struct.Struct("!H")
+LENGTH = struct.Struct("!H")
+
+HAS_POSITION = 1       # Player flag: x y z follow
+HAS_META = 2           # Player flag: other fields follow as JSON
+HAS_VELOCITY = 4       # Player flag: vx vy vz follow
+HAS_FACING = 8         # Player flag: yaw follows
+
+WIRE_FIELDS = frozenset(POSITION_FIELDS + VELOCITY_FIELDS + (FACING_FIELD,))
+
+
+def set_world_bounds(world_min, world_max):
+    """Use [world_min, world_max] on every axis; resolution is 65535 steps across it."""
+    global WORLD_MIN, WORLD_MAX, POS_SCALE
+    if not world_max > world_min:
+        raise ValueError(f"Empty world bounds: {world_min} .. {world_max}")
+    WORLD_MIN = float(world_min)
+    WORLD_MAX = float(world_max)
+    POS_SCALE = 65535 / (WORLD_MAX - WORLD_MIN)
+
+
+def world_bounds():
+    return {"min": WORLD_MIN, "max": WORLD_MAX}
+
+
+def _clamp_coord(value):
+    global clamped, _clamp_warned_at
+    clamped += 1
+    now = time.monotonic()
+    if _clamp_warned_at is None or now - _clamp_warned_at >= CLAMP_WARN_INTERVAL:
+        _clamp_warned_at = now
+        print(f"WARNING: coordinate {value:.1f} is outside the world bounds "
+              f"[{WORLD_MIN:g}, {WORLD_MAX:g}] and was clamped ({clamped} so far)")
+    return min(max(value, WORLD_MIN), WORLD_MAX)
+
+
+def _pack_coord(value):
+    if not WORLD_MIN <= value <= WORLD_MAX:
+        value = _clamp_coord(value)
+    return round((value - WORLD_MIN) * POS_SCALE)
+
+
+def _unpack_coord(q):
+    return q / POS_SCALE + WORLD_MIN
+
+
+def quantize(value):
+    """Round a coordinate to the nearest value the wire format can carry."""
+    return _unpack_coord(_pack_coord(value))
+
+
+def _pack_velocity(value):
+    return round(min(max(value, -VEL_MAX), VEL_MAX) * VEL_SCALE)
+
+
+def quantize_velocity(value):
+    return _pack_velocity(value) / VEL_SCALE
+
+
+def _pack_yaw(value):
+    return round((value % 360.0) * YAW_SCALE) & 0xFFFF
+
+
+def quantize_yaw(value):
+    return _pack_yaw(value) / YAW_SCALE
+
+
+def _pack_json(obj):
+    data = json.dumps(obj, separators=(",", ":")).encode()
+    return LENGTH.pack(len(data)) + data
+
+
+def _unpack_json(data, offset):
+    (length,) = LENGTH.unpack_from(data, offset)
+    offset += LENGTH.size
+    return json.loads(bytes(data[offset:offset + length]).decode()), offset + length
+
+
+def encode_player(pid, fields):
+    """Encode one player record (`fields` of a snapshot message) to bytes."""
+    pflags = 0
+    body = []
+    if "x" in fields:
+        pflags |= HAS_POSITION
+        body.append(POSITION.pack(_pack_coord(fields["x"]), _pack_coord(fields["y"]),
+                                  _pack_coord(fields["z"])))
+    meta = {k: v for k, v in fields.items() if k not in WIRE_FIELDS}
+    if meta:
+        pflags |= HAS_META
+        body.append(_pack_json(meta))
+    if "vx" in fields:
+        pflags |= HAS_VELOCITY
+        body.append(VELOCITY.pack(_pack_velocity(fields["vx"]), _pack_velocity(fields["vy"]),
+                                  _pack_velocity(fields["vz"])))
+    if FACING_FIELD in fields:
+        pflags |= HAS_FACING
+        body.append(FACING.pack(_pack_yaw(fields[FACING_FIELD])))
+    return PLAYER_HEADER.pack(int(pid) & 0xFFFF, pflags) + b"".join(body)
+
+
+def decode_snapshot(data):
+    """Decode bytes from SnapshotEncoder.encode back into a snapshot message."""
+    seq, base, server_time, n_players, n_removed, flags = SNAP_HEADER.unpack_from(data)
+    offset = SNAP_HEADER.size
+    players = {}
+    for _ in range(n_players):
+        pid, pflags = PLAYER_HEADER.unpack_from(data, offset)
+        offset += PLAYER_HEADER.size
+        fields = {}
+        if pflags & HAS_POSITION:
+            x, y, z = POSITION.unpack_from(data, offset)
+            offset += POSITION.size
+            fields["x"], fields["y"], fields["z"] = _unpack_coord(x), _unpack_coord(y), _unpack_coord(z)
+        if pflags & HAS_META:
+            meta, offset = _unpack_json(data, offset)
+            fields.update(meta)
+        if pflags & HAS_VELOCITY:
+            vx, vy, vz = VELOCITY.unpack_from(data, offset)
+            offset += VELOCITY.size
+            fields["vx"], fields["vy"], fields["vz"] = vx / VEL_SCALE, vy / VEL_SCALE, vz / VEL_SCALE
+        if pflags & HAS_FACING:
+            (yaw,) = FACING.unpack_from(data, offset)
+            offset += FACING.size
+            fields[FACING_FIELD] = yaw / YAW_SCALE
+        players[str(pid)] = fields
+    removed = []
+    for _ in range(n_removed):
+        (pid,) = ID.unpack_from(data, offset)
+        offset += ID.size
+        removed.append(str(pid))
+    return {"type": "snapshot", "seq": seq, "base": None if base == NO_BASE else base,
+            "time": server_time, "players": players, "removed": removed}
+
+
+def diff_fields(old, pdata):
+    """Fields of `pdata` that differ from `old`, a different record of the same player."""
+    fields = {k: v for k, v in pdata.items() if old.get(k) != v}
+    # Positions (and velocities) always travel as a whole triple
+    if any(k in fields for k in POSITION_FIELDS):
+        fields.update({k: pdata[k] for k in POSITION_FIELDS})
+    if any(k in fields for k in VELOCITY_FIELDS) and "vx" in pdata:
+        fields.update({k: pdata[k] for k in VELOCITY_FIELDS})
+    return fields
+
+
+_UNKNOWN = object()
+
+
+class SnapshotEncoder:
+    """
+    Encodes one snapshot for many clients. Each player's record is diffed
+    and packed once per baseline and reused for every client whose view
+    contains that player, so per-client work is joining cached bytes.
+    """
+
+    def __init__(self, seq, state, history, server_time):
+        self.seq = seq
+        self.players = state["players"]
+        self.history = history  # seq -> state, for baselines
+        self.time = server_time
+        self._full = {}         # pid -> record
+        self._delta = {}        # base_seq -> {pid: record, or None if unchanged}
+
+    def _full_record(self, pid):
+        record = self._full.get(pid)
+        if record is None:
+            record = self._full[pid] = encode_player(pid, self.players[pid])
+        return record
+
+    def _delta_record(self, deltas, old, pid):
+        pdata = self.players[pid]
+        record = deltas[pid] = None if old == pdata else encode_player(pid, diff_fields(old, pdata))
+        return record
+
+    def encode(self, base_seq=None, view=None, base_view=None):
+        """
+        Bytes of the snapshot against baseline `base_seq` (full if None).
+        `view`/`base_view` are the sets of player ids the client sees now and
+        saw in the baseline (None means everyone). Players new to the client
+        are sent in full, others only with the fields that changed; players
+        that left the view or the game are listed as removed.
+        """
+        players = self.players
+        pids = players if view is None else [pid for pid in view if pid in players]
+        removed = []
+        if base_seq is None:
+            records = [self._full_record(pid) for pid in pids]
+        else:
+            base_players = self.history[base_seq]["players"]
+            deltas = self._delta.setdefault(base_seq, {})
+            records = []
+            for pid in pids:
+                old = base_players.get(pid)
+                if old is None or base_view is not None and pid not in base_view:
+                    records.append(self._full_record(pid))  # New to this client
+                    continue
+                record = deltas.get(pid, _UNKNOWN)
+                if record is _UNKNOWN:
+                    record = self._delta_record(deltas, old, pid)
+                if record is not None:
+                    records.append(record)
+            for pid in (base_players if base_view is None else base_view):
+                if pid in base_players and (pid not in players or view is not None and pid not in view):
+                    removed.append(ID.pack(int(pid) & 0xFFFF))
+        header = SNAP_HEADER.pack(self.seq, NO_BASE if base_seq is None else base_seq, self.time,
+                                  len(records), len(removed), 0)
+        return b"".join([header, *records, *removed])
+
+
+class SnapshotReceiver:
+    """Client-side reassembly of delta snapshots into full states."""
+
+    def __init__(self):
+        self.history = {}  # seq -> state
+        self.latest = None
+
+    def apply(self, msg):
+        """
+        Apply a snapshot message. Returns the new state, the current state if the
+        message is stale, or None if its baseline is unknown (resync needed).
+        """
+        seq = msg["seq"]
+        if self.latest is not None and seq <= self.latest:
+            return self.history.get(self.latest)
+
+        base_seq = msg.get("base")
+        if base_seq is None:
+            players = {}
+        else:
+            base = self.history.get(base_seq)
+            if base is None:
+                return None
+            players = dict(base["players"])
+
+        for pid, fields in msg.get("players", {}).items():
+            if pid in players:
+                players[pid] = {**players[pid], **fields}
+            else:
+                players[pid] = fields
+        for pid in msg.get("removed", []):
+            players.pop(pid, None)
+
+        state = {"players": players}
+        self.history[seq] = state
+        for old in [s for s in self.history if s <= seq - HISTORY_SIZE]:
+            del self.history[old]
+        self.latest = seq
+        return state
+
+    def reset(self):
+        self.history.clear()
+        self.latest = None